@@ -0,0 +1,6 @@
+"""
+Benchmarks of the Videofront XBlock, run against an in-memory runtime and a
+local Videofront stub server:
+
+    python -m benchmarks.run --help
+"""
@@ -0,0 +1,373 @@
+"""
+Run the benchmarks and save, or compare against, a baseline:
+
+    python -m benchmarks.run --output benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json
+
+Durations are in microseconds per call; throughputs in calls per second.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import threading
+import time
+
+from webob import Request
+
+from .runtime import BenchmarkRuntime, configure_django, post_json
+from .stub import VideofrontStub
+
+# Video lengths, in seconds, from 1 minute to 3 hours
+VIDEO_LENGTHS = (60, 600, 3600, 3 * 3600)
+
+HANDLER_PAYLOADS = {
+    'like_dislike': {'voteType': 'like'},
+    'report': {'voteType': 'audio'},
+    'saveTimeline': {'timeline': ",".join(["1"] * 600)},
+    'saveTotalWatchTime': {'watchTime': 42, 'watchDate': '2020-01-01'},
+    'saveTranscriptDownloaded': {},
+    'saveVideoDownloaded': {},
+    'saveMostUsedControls': {'controls': "1,0,2,0,0,0,0,0,0,0,0"},
+    'ingest_events': {'events': [
+        {'type': 'watch_time', 'watchTime': 42, 'watchDate': '2020-01-01'},
+        {'type': 'controls', 'controls': "1,0,2,0,0,0,0,0,0,0,0"},
+        {'type': 'video_download'},
+    ]},
+    'analytics': {},
+}
+
+
+def measure(func, number, repeat):
+    """
+    Call `func` `number` times, `repeat` times over.
+
+    Returns:
+        result (dict): best and median durations of a call, in microseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        for _ in range(number):
+            func()
+        timings.append((time.time() - start) / number * 1e6)
+    timings.sort()
+    return {'unit': 'us', 'best': round(timings[0], 1), 'median': round(timings[len(timings) // 2], 1)}
+
+
+def throughput(func, duration):
+    """
+    Returns:
+        result (dict): number of calls of `func` per second, over `duration`
+        seconds.
+    """
+    calls = 0
+    start = time.time()
+    while time.time() - start < duration:
+        func()
+        calls += 1
+    return {'unit': 'calls/s', 'value': round(calls / (time.time() - start), 1)}
+
+
+def make_timeline(length, seed=0):
+    generator = random.Random(seed)
+    return [generator.randint(0, 500) for _ in range(length)]
+
+
+class Benchmarks(object):
+
+    def __init__(self, stub, number=20, repeat=5, duration=1, settings=None):
+        from videofront_xblock import VideofrontXBlock
+        from videofront_xblock import timeline
+        self.block_class = VideofrontXBlock
+        self.timeline = timeline
+        self.stub = stub
+        self.number = number
+        self.repeat = repeat
+        self.duration = duration
+        self.settings = {'HOST': stub.url, 'TOKEN': 'benchmark', 'PREFETCH': False}
+        self.settings.update(settings or {})
+        self.results = {}
+
+    def make_runtime(self, **settings):
+        bucket = dict(self.settings)
+        bucket.update(settings)
+        return BenchmarkRuntime(bucket)
+
+    def record(self, name, result):
+        self.results[name] = result
+        value = result.get('median', result.get('value'))
+        sys.stderr.write("{:<45} {:>12} {}\n".format(name, value, result['unit']))
+
+    def run(self):
+        self.bench_build_fragment()
+        self.bench_get_video_context()
+        self.bench_timelines()
+        self.bench_transcripts()
+        self.bench_handlers()
+        self.bench_counters_stress()
+        self.bench_failover()
+        return self.results
+
+    def bench_build_fragment(self):
+        runtime = self.make_runtime()
+        block = runtime.make_block(self.block_class, video_id='rendered')
+        block.build_fragment()
+        self.record('build_fragment', measure(block.build_fragment, self.number, self.repeat))
+        runtime = self.make_runtime(DEFERRED_RENDER=True)
+        block = runtime.make_block(self.block_class, video_id='rendered')
+        self.record('build_fragment.deferred', measure(block.build_fragment, self.number, self.repeat))
+
+    def bench_get_video_context(self):
+        runtime = self.make_runtime()
+        block = runtime.make_block(self.block_class, video_id='cached')
+        block.get_video_context('cached')
+        self.record('get_video_context.cached', measure(
+            lambda: block.get_video_context('cached'), self.number, self.repeat
+        ))
+        self.record('handler.manifest.cached', measure(
+            lambda: runtime.handle(block, 'manifest', Request.blank('/')), self.number, self.repeat
+        ))
+        ids = iter(range(self.number * self.repeat))
+        self.record('get_video_context.uncached', measure(
+            lambda: block.get_video_context('uncached-{}'.format(next(ids))), self.number, self.repeat
+        ))
+        ids = iter(range(self.number * self.repeat))
+        self.record('get_video_context.not_found', measure(
+            lambda: block.get_video_context('missing-{}'.format(next(ids))), self.number, self.repeat
+        ))
+
+    def bench_timelines(self):
+        runtime = self.make_runtime()
+        # Compactions are not measured
+        counters_runtime = self.make_runtime(COUNTERS_BACKEND='local', COUNTERS_COMPACT_INTERVAL=3600)
+        for length in VIDEO_LENGTHS:
+            total_timeline = self.timeline.encode(self.timeline.parse_csv(
+                ",".join(str(count) for count in make_timeline(length))
+            ))
+            block = runtime.make_block(self.block_class, total_timeline=total_timeline, total_views=100)
+
+            # The user progressively watches the video
+            calls = self.number * self.repeat
+            payloads = [
+                {'timeline': ",".join(
+                    "1" if second < length * (call + 1) // calls else "0" for second in range(length)
+                )}
+                for call in range(calls)
+            ]
+            payloads = iter(payloads)
+            self.record('saveTimeline.{}s'.format(length), measure(
+                lambda: post_json(block, 'saveTimeline', next(payloads)), self.number, self.repeat
+            ))
+            self.record('calculateTimeline.{}s'.format(length), measure(
+                block.calculateTimeline, self.number, self.repeat
+            ))
+
+            # Ranges of newly watched seconds, as sent every 30 seconds. With
+            # aggregate counters, they are appended to a log instead of being
+            # applied to the total timeline.
+            step = 30
+            for watched_runtime, suffix in ((runtime, ''), (counters_runtime, '.counters')):
+                watched_block = watched_runtime.make_block(
+                    self.block_class, total_timeline=total_timeline, total_views=100
+                )
+                ranges = iter([call * step % length for call in range(calls)])
+                self.record('watched{}.{}s'.format(suffix, length), measure(
+                    lambda: post_json(watched_block, 'ingest_events', {
+                        'events': [self.watched_event(next(ranges), step, length)]
+                    }),
+                    self.number, self.repeat
+                ))
+
+    @staticmethod
+    def watched_event(start, step, length):
+        return {'type': 'watched', 'ranges': [[start, start + step]], 'position': start + step, 'duration': length}
+
+    def bench_transcripts(self):
+        from videofront_xblock import transcripts
+        from .stub import webvtt_payload
+        content = webvtt_payload()
+        self.record('parse_webvtt.{}cues'.format(len(transcripts.parse_webvtt(content)['starts'])), measure(
+            lambda: transcripts.parse_webvtt(content), 1, self.repeat
+        ))
+        runtime = self.make_runtime()
+        block = runtime.make_block(self.block_class, video_id='transcripts')
+        runtime.handle(block, 'transcript', Request.blank('/'), 'en')
+        self.record('handler.transcript.cached', measure(
+            lambda: runtime.handle(block, 'transcript', Request.blank('/'), 'en'), self.number, self.repeat
+        ))
+
+    def bench_handlers(self):
+        for counters_backend in (None, 'local'):
+            runtime = self.make_runtime(COUNTERS_BACKEND=counters_backend)
+            block = runtime.make_block(self.block_class, video_id='handlers')
+            suffix = '.counters' if counters_backend else ''
+            for handler_name in sorted(HANDLER_PAYLOADS):
+                payload = HANDLER_PAYLOADS[handler_name]
+                self.record('handler.{}{}'.format(handler_name, suffix), throughput(
+                    lambda: post_json(block, handler_name, payload), self.duration
+                ))
+
+    def bench_counters_stress(self, threads=16, write_latency=0.001):
+        """
+        Concurrent view reports and votes on the same block, each handled by a
+        new block instance like in the LMS. Writes of summary fields are
+        serialized, like updates of a database row. With aggregate counters,
+        no increment is lost, and handlers do not wait for each other.
+        """
+        calls = self.number * self.repeat
+        for handler_name, expected in (('saveTotalWatchTime', 'total_views'), ('like_dislike', 'dislike_count')):
+            for counters_backend in (None, 'local'):
+                runtime = BenchmarkRuntime(
+                    dict(self.settings, COUNTERS_BACKEND=counters_backend, COUNTERS_COMPACT_INTERVAL=0.01),
+                    summary_write_latency=write_latency,
+                )
+                usage_id = 'stress-{}-{}'.format(handler_name, counters_backend)
+                elapsed, block = self.run_stress(runtime, usage_id, handler_name, threads, calls)
+                suffix = '.counters' if counters_backend else ''
+                if counters_backend and getattr(block, expected) != threads * calls:
+                    raise AssertionError("Lost increments of {}: {} instead of {}".format(
+                        expected, getattr(block, expected), threads * calls
+                    ))
+                # Votes are two handler calls per learner
+                handler_calls = threads * calls * (2 if handler_name == 'like_dislike' else 1)
+                self.record('counters_stress.{}{}.{}threads'.format(handler_name, suffix, threads), {
+                    'unit': 'calls/s', 'value': round(handler_calls / elapsed, 1)
+                })
+
+    def run_stress(self, runtime, usage_id, handler_name, threads, calls):
+        """
+        Returns:
+            elapsed (float): duration of the calls, in seconds
+            block: instance of the block, after a final compaction
+        """
+        errors = []
+
+        def call_handler(thread):
+            try:
+                for call in range(calls):
+                    user_id = 'user-{}-{}'.format(thread, call)
+                    if handler_name == 'like_dislike':
+                        # Like, then dislike: one dislike per learner
+                        block = runtime.make_block(self.block_class, usage_id=usage_id, user_id=user_id)
+                        post_json(block, handler_name, {'voteType': 'like'})
+                        payload = {'voteType': 'dislike'}
+                    else:
+                        payload = {'watchTime': 1, 'watchDate': '2020-01-01'}
+                    block = runtime.make_block(self.block_class, usage_id=usage_id, user_id=user_id)
+                    post_json(block, handler_name, payload)
+            except Exception as e: # pylint: disable=broad-except
+                errors.append(e)
+
+        workers = [threading.Thread(target=call_handler, args=(thread,)) for thread in range(threads)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+        if errors:
+            raise errors[0]
+        time.sleep(0.02)
+        block = runtime.make_block(self.block_class, usage_id=usage_id)
+        block.compact_aggregates()
+        return elapsed, runtime.make_block(self.block_class, usage_id=usage_id)
+
+    def bench_failover(self, probe_interval=0.05):
+        """
+        Metadata requests with a primary host that is down and two other hosts,
+        one of which is 10 times slower than the other.
+        """
+        latency = self.stub.latency or 0.005
+        with VideofrontStub(error_rate=1) as down, \
+                VideofrontStub(latency=10 * latency) as slow, \
+                VideofrontStub(latency=latency) as fast:
+            runtime = self.make_runtime(
+                HOST=down.url, HOSTS=[slow.url, fast.url], HOSTS_PROBE_INTERVAL=probe_interval,
+                RETRIES=0, MIRRORS={down.url: [slow.url, fast.url]},
+            )
+            block = runtime.make_block(self.block_class, video_id='warmup')
+            # Hosts are probed once the client is created, on the first request
+            block.build_fragment()
+            time.sleep(20 * latency + 2 * probe_interval)
+            ids = iter(range(self.number * self.repeat))
+            self.record('failover.get_video_context.uncached', measure(
+                lambda: block.get_video_context('failover-{}'.format(next(ids))), self.number, self.repeat
+            ))
+            self.record('failover.build_fragment.mirrors', measure(block.build_fragment, self.number, self.repeat))
+            if any(video_id.startswith('failover') for video_id in list(down.video_requests) + list(slow.video_requests)):
+                raise AssertionError("Metadata were not fetched from the fastest healthy host")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns:
+        regressions (list): names of the benchmarks that are slower than the
+        baseline by more than `tolerance` (a fraction), or that are missing
+        from the baseline, which must then be regenerated.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        reference = baseline['results'].get(name)
+        if reference is None:
+            regressions.append(name)
+            sys.stderr.write("MISSING FROM BASELINE {}\n".format(name))
+            continue
+        if result['unit'] == 'us':
+            regressed = result['median'] > reference['median'] * (1 + tolerance)
+            change = result['median'] / reference['median'] - 1 if reference['median'] else 0
+        else:
+            regressed = result['value'] < reference['value'] / (1 + tolerance)
+            change = reference['value'] / result['value'] - 1 if result['value'] else 0
+        if regressed:
+            regressions.append(name)
+            sys.stderr.write("REGRESSION {}: {:+.0%}\n".format(name, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Videofront XBlock")
+    parser.add_argument('--output', help="Save the results as a JSON baseline")
+    parser.add_argument('--compare', help="Compare the results to a JSON baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Slowdown, as a fraction, above which a result is a regression")
+    parser.add_argument('--latency', type=float, default=0.005, help="Stub server latency, in seconds")
+    parser.add_argument('--error-rate', type=float, default=0, help="Stub server 503 error rate")
+    parser.add_argument('--number', type=int, default=20, help="Calls per timing")
+    parser.add_argument('--repeat', type=int, default=5, help="Timings per benchmark")
+    parser.add_argument('--duration', type=float, default=1, help="Duration of throughput benchmarks")
+    args = parser.parse_args(argv)
+
+    configure_django()
+    with VideofrontStub(latency=args.latency, error_rate=args.error_rate) as stub:
+        results = Benchmarks(
+            stub, number=args.number, repeat=args.repeat, duration=args.duration,
+            settings={'RETRY_BACKOFF': 0},
+        ).run()
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'number': args.number,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+In-memory XBlock runtime for the benchmarks.
+"""
+import itertools
+import json
+import threading
+import time
+
+from webob import Request
+from xblock.fields import Scope, ScopeIds
+from xblock.runtime import DictKeyValueStore, KvsFieldData
+from xblock.test.tools import TestRuntime
+
+
+def configure_django():
+    """Minimal Django configuration, when not running inside the platform."""
+    import django
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(
+            INSTALLED_APPS=[],
+            TEMPLATES=[{'BACKEND': 'django.template.backends.django.DjangoTemplates'}],
+        )
+        django.setup()
+
+
+class SettingsService(object):
+    """Serve the same `XBLOCK_SETTINGS` bucket to all blocks."""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def get_settings_bucket(self, block, default=None): # pylint: disable=unused-argument
+        return self.bucket
+
+
+class RowLockingKeyValueStore(DictKeyValueStore):
+    """
+    Key-value store where writes of summary fields take `write_latency`
+    seconds while holding a lock, like an update of the single database row
+    that all the learners of a block share.
+    """
+
+    def __init__(self, write_latency=0):
+        super(RowLockingKeyValueStore, self).__init__()
+        self.write_latency = write_latency
+        self._row_lock = threading.Lock()
+
+    def set_many(self, update_dict):
+        if self.write_latency and any(key.scope == Scope.user_state_summary for key in update_dict):
+            with self._row_lock:
+                time.sleep(self.write_latency)
+                super(RowLockingKeyValueStore, self).set_many(update_dict)
+        else:
+            super(RowLockingKeyValueStore, self).set_many(update_dict)
+
+
+class BenchmarkRuntime(TestRuntime):
+    """
+    Runtime whose field data are stored in a single key-value store, shared
+    by all the blocks it creates: like in the LMS, every block instance loads
+    its fields from the store and writes them back on `save()`.
+
+    Args:
+        settings (dict): `XBLOCK_SETTINGS` bucket
+        summary_write_latency (float): duration of the writes of summary
+        fields, which are serialized (see `RowLockingKeyValueStore`)
+    """
+
+    def __init__(self, settings, summary_write_latency=0):
+        self.store = RowLockingKeyValueStore(summary_write_latency)
+        super(BenchmarkRuntime, self).__init__(services={
+            'settings': SettingsService(settings),
+            'field-data': KvsFieldData(self.store),
+        })
+        self._ids = itertools.count()
+
+    def local_resource_url(self, block, uri):
+        return '/resource/{}/{}'.format(block.scope_ids.block_type, uri)
+
+    def handler_url(self, block, handler_name, suffix='', query='', thirdparty=False):
+        return '/handler/{}/{}'.format(block.scope_ids.usage_id, handler_name)
+
+    def make_block(self, block_class, usage_id=None, user_id='student', **fields):
+        """
+        Create a block. Passing the `usage_id` of a previous block creates
+        a new instance of the same block.
+        """
+        usage_id = usage_id or 'block-{}'.format(next(self._ids))
+        scope_ids = ScopeIds(user_id, 'videofront-xblock', 'def-' + usage_id, usage_id)
+        block = self.construct_xblock_from_class(block_class, scope_ids=scope_ids)
+        for name, value in fields.items():
+            setattr(block, name, value)
+        if fields:
+            block.save()
+        return block
+
+
+def post_json(block, handler_name, data):
+    """
+    Call a json handler like the LMS does.
+
+    Returns:
+        result: decoded response body
+    """
+    request = Request.blank('/', method='POST', body=json.dumps(data).encode('utf8'))
+    response = block.runtime.handle(block, handler_name, request)
+    if response.status_code != 200:
+        raise RuntimeError("{} handler failed with status {}".format(handler_name, response.status_code))
+    return json.loads(response.body.decode('utf8'))
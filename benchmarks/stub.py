@@ -0,0 +1,161 @@
+"""
+Local HTTP server that mimics the Videofront API.
+"""
+import json
+import random
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+VIDEO_PATH_PREFIX = '/api/v1/videos/'
+SUBTITLES_PATH_PREFIX = '/subtitles/'
+# Number of cues of the generated subtitles: about 3 hours of speech
+SUBTITLE_CUES = 3000
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def video_payload(host, video_id):
+    """Video metadata, as returned by Videofront for a processed video."""
+    return {
+        'id': video_id,
+        'title': video_id,
+        'thumbnail': host + '/thumbnails/' + video_id + '.jpg',
+        'poster_frames': host + '/posters/' + video_id + '.vtt',
+        'processing': {'status': 'success', 'progress': 100},
+        'formats': [
+            {'name': 'SD', 'url': host + '/videos/' + video_id + '/SD.mp4', 'bitrate': 0.5},
+            {'name': 'HD', 'url': host + '/videos/' + video_id + '/HD.mp4', 'bitrate': 2},
+        ],
+        'subtitles': [
+            {'language': 'en', 'url': host + '/subtitles/' + video_id + '/en.vtt'},
+            {'language': 'fr', 'url': host + '/subtitles/' + video_id + '/fr.vtt'},
+        ],
+    }
+
+
+def webvtt_payload(cues=SUBTITLE_CUES):
+    """Subtitles with one 3.5 seconds cue every 4 seconds."""
+    def timestamp(seconds):
+        return '{:02d}:{:02d}:{:02d}.{:03d}'.format(
+            int(seconds // 3600), int(seconds % 3600 // 60), int(seconds % 60), int(seconds * 1000 % 1000)
+        )
+    lines = ['WEBVTT', '']
+    for cue in range(cues):
+        lines.append('{} --> {}'.format(timestamp(cue * 4), timestamp(cue * 4 + 3.5)))
+        lines.append('Sentence number {} of the lecture, with <i>some</i> markup.'.format(cue))
+        lines.append('')
+    return '\n'.join(lines)
+
+
+class VideofrontStub(object):
+    """
+    Serve `/api/v1/videos/<id>/`, and the subtitles of the videos, on a
+    random local port.
+
+    Args:
+        latency (float): delay of every response, in seconds
+        error_rate (float): probability of responding with a 503 error
+        seed (int): seed of the error generator, for reproducible runs
+        processing_requests (int): number of requests after which videos that
+        are being processed are ready; None if they are never ready.
+
+    Videos whose id starts with "missing" are not found; those whose id starts
+    with "processing" are being processed.
+    """
+
+    def __init__(self, latency=0, error_rate=0, seed=0, processing_requests=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.processing_requests = processing_requests
+        self.requests = 0
+        self.video_requests = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def respond(self, path):
+        """
+        Returns:
+            status (int)
+            body (dict or str): JSON object, or subtitles
+        """
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            return 503, {'detail': 'Service unavailable'}
+        if path.startswith(SUBTITLES_PATH_PREFIX):
+            return 200, webvtt_payload()
+        if not path.startswith(VIDEO_PATH_PREFIX):
+            return 404, {'detail': 'Not found'}
+        video_id = path[len(VIDEO_PATH_PREFIX):].strip('/')
+        with self._lock:
+            self.video_requests[video_id] = requests = self.video_requests.get(video_id, 0) + 1
+        if video_id.startswith('missing'):
+            return 404, {'detail': 'Not found'}
+        video = video_payload(self.url, video_id)
+        if video_id.startswith('processing') and (
+                self.processing_requests is None or requests <= self.processing_requests
+        ):
+            video['processing'] = {'status': 'processing', 'progress': 42}
+        return 200, video
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = stub.respond(self.path)
+                if isinstance(body, dict):
+                    content_type, content = 'application/json', json.dumps(body).encode('utf8')
+                else:
+                    content_type, content = 'text/vtt', body.encode('utf8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_HEAD(self):
+                # Latency probes
+                status, _body = stub.respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
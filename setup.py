@@ -1,5 +1,8 @@
 import os
+import runpy
+
 from setuptools import setup
+from setuptools.command.build_py import build_py
 
 
 def package_data(pkg, roots):
@@ -18,6 +21,21 @@ def package_data(pkg, roots):
     return {pkg: data}
 
 
+class BuildPyCommand(build_py):
+    """Generate the minified static asset bundles before building."""
+
+    def run(self):
+        # The package itself cannot be imported before its dependencies are
+        # installed, so the module is run from its path.
+        assets = runpy.run_path(os.path.join('videofront_xblock', 'assets.py'))
+        assets['build']()
+        build_py.run(self)
+
+
+PACKAGE_DATA = package_data("videofront_xblock", ["static", "public"])
+# Bundles are generated by BuildPyCommand, after this list was computed
+PACKAGE_DATA["videofront_xblock"].append("public/dist/*")
+
 setup(
     name='videofront-xblock',
     version='0.1',
@@ -28,10 +46,20 @@ setup(
     install_requires=[
         'XBlock', 'xblock-utils', 'requests'
     ],
+    # Minifiers of the static asset bundles, see BuildPyCommand
+    setup_requires=[
+        'rcssmin', 'rjsmin',
+    ],
     entry_points={
         'xblock.v1': [
             'videofront-xblock = videofront_xblock:VideofrontXBlock',
-        ]
+        ],
+        'console_scripts': [
+            'videofront-xblock-export = videofront_xblock.export:main',
+        ],
+    },
+    package_data=PACKAGE_DATA,
+    cmdclass={
+        'build_py': BuildPyCommand,
     },
-    package_data=package_data("videofront_xblock", ["static", "public"]),
 )
@@ -0,0 +1,3 @@
+from benchmarks.runtime import configure_django
+
+configure_django()
@@ -0,0 +1,102 @@
+import json
+import socket
+import time
+
+from webob import Request
+
+from benchmarks.runtime import BenchmarkRuntime
+from benchmarks.stub import VideofrontStub
+from videofront_xblock import VideofrontXBlock
+from videofront_xblock.client import HostSelector, VideofrontClient, get_mirrors, rewrite_url
+from videofront_xblock.refresh import get_scheduler
+
+
+def make_client(host, hosts):
+    # Probes start in the background right away: they must not be repeated
+    # during the tests
+    return VideofrontClient(host, 'token', retries=0, hosts=hosts, probe_interval=3600)
+
+
+def test_failover_on_connection_error():
+    # Nothing listens on this port once the socket is closed
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    closed_url = 'http://127.0.0.1:{}'.format(sock.getsockname()[1])
+    sock.close()
+    with VideofrontStub() as healthy:
+        response = make_client(closed_url, [healthy.url]).get_video('video')
+        assert response.status_code == 200
+        assert response.json()['id'] == 'video'
+
+
+def test_failover_on_server_error():
+    with VideofrontStub(error_rate=1) as failing, VideofrontStub() as healthy:
+        response = make_client(failing.url, [healthy.url]).get_video('video')
+        assert response.status_code == 200
+        assert healthy.video_requests == {'video': 1}
+
+
+def test_probes_rank_hosts():
+    with VideofrontStub(error_rate=1) as failing, \
+            VideofrontStub(latency=0.05) as slow, \
+            VideofrontStub() as fast:
+        selector = HostSelector([failing.url, slow.url, fast.url])
+        assert selector.best() == failing.url
+        selector.probe()
+        assert selector.ranked() == [fast.url, slow.url, failing.url]
+        assert selector.breakers[failing.url].is_open
+
+
+def test_probe_closes_circuit():
+    with VideofrontStub() as stub:
+        selector = HostSelector([stub.url], reset_timeout=3600)
+        breaker = selector.breakers[stub.url]
+        breaker.trip()
+        assert not breaker.allow_request()
+        selector.probe()
+        assert not breaker.is_open
+        assert breaker.allow_request()
+
+
+def test_probes_do_not_wait_for_refreshes():
+    get_scheduler().schedule('slow-refresh', lambda: time.sleep(2), delay=0, max_delay=1, timeout=0)
+    with VideofrontStub() as stub:
+        selector = HostSelector([stub.url])
+        selector.schedule_probes(3600)
+        deadline = time.time() + 1
+        while not selector.latencies and time.time() < deadline:
+            time.sleep(0.01)
+        assert stub.url in selector.latencies
+
+
+def test_rewrite_url():
+    selector = HostSelector(['http://a.com', 'http://mirror.com'])
+    selector.breakers['http://a.com'].trip()
+    mirrors = [('http://a.com', selector)]
+    assert rewrite_url(mirrors, 'http://a.com/videos/HD.mp4') == 'http://mirror.com/videos/HD.mp4'
+    # Origins only match up to a path separator
+    assert rewrite_url(mirrors, 'http://a.com.evil/videos/HD.mp4') == 'http://a.com.evil/videos/HD.mp4'
+    assert rewrite_url(mirrors, 'http://a.com2/videos/HD.mp4') == 'http://a.com2/videos/HD.mp4'
+    assert rewrite_url(mirrors, 'http://a.com') == 'http://a.com'
+
+
+def test_manifest_mirrors():
+    with VideofrontStub(latency=0.05) as origin, VideofrontStub() as mirror:
+        settings = {
+            'HOST': origin.url,
+            'TOKEN': 'token',
+            'MIRRORS': {origin.url: [mirror.url]},
+            'HOSTS_PROBE_INTERVAL': 3600,
+        }
+        selector = get_mirrors(settings)[0][1]
+        deadline = time.time() + 5
+        while len(selector.latencies) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        block = BenchmarkRuntime(settings).make_block(VideofrontXBlock, video_id='mirrored')
+
+        response = block.runtime.handle(block, 'manifest', Request.blank('/'))
+
+        renditions = json.loads(response.body.decode('utf8'))['renditions']
+        assert [rendition['src'] for rendition in renditions] == [
+            mirror.url + '/videos/mirrored/SD.mp4', mirror.url + '/videos/mirrored/HD.mp4',
+        ]
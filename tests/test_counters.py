@@ -0,0 +1,194 @@
+import hashlib
+import threading
+import time
+
+from benchmarks.runtime import BenchmarkRuntime, post_json
+from videofront_xblock import VideofrontXBlock
+from videofront_xblock.counters import AggregateCounters, LocalCounterStore
+from videofront_xblock.rollups import Rollups
+
+
+def run_threads(target, threads):
+    errors = []
+
+    def run(index):
+        try:
+            target(index)
+        except Exception as e: # pylint: disable=broad-except
+            errors.append(e)
+
+    workers = [threading.Thread(target=run, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+
+
+def compacted_block(runtime, usage_id):
+    # Wait for the compaction lock to expire
+    time.sleep(0.02)
+    block = runtime.make_block(VideofrontXBlock, usage_id=usage_id)
+    block.compact_aggregates()
+    return runtime.make_block(VideofrontXBlock, usage_id=usage_id)
+
+
+def test_concurrent_like_dislike(threads=16, calls=50):
+    """
+    Every learner likes, then dislikes, the same block. Each call is handled
+    by a new block instance, like in the LMS, and compactions overlap with
+    the calls.
+    """
+    runtime = BenchmarkRuntime({'COUNTERS_BACKEND': 'local', 'COUNTERS_COMPACT_INTERVAL': 0.01})
+    # Counter stores are shared by the whole process
+    usage_id = 'like-dislike'
+
+    def vote(thread):
+        for call in range(calls):
+            user_id = 'user-{}-{}'.format(thread, call)
+            for vote_type in ('like', 'dislike'):
+                block = runtime.make_block(VideofrontXBlock, usage_id=usage_id, user_id=user_id)
+                post_json(block, 'like_dislike', {'voteType': vote_type})
+
+    run_threads(vote, threads)
+    block = compacted_block(runtime, usage_id)
+    assert block.like_count == 0
+    assert block.dislike_count == threads * calls
+
+
+def test_concurrent_views(threads=16, calls=50):
+    runtime = BenchmarkRuntime({'COUNTERS_BACKEND': 'local', 'COUNTERS_COMPACT_INTERVAL': 0.01})
+    usage_id = 'views'
+
+    def watch(thread):
+        for _ in range(calls):
+            block = runtime.make_block(VideofrontXBlock, usage_id=usage_id, user_id='user-{}'.format(thread))
+            post_json(block, 'saveTotalWatchTime', {'watchTime': 2, 'watchDate': '2020-01-01'})
+
+    run_threads(watch, threads)
+    block = compacted_block(runtime, usage_id)
+    assert block.total_views == threads * calls
+    assert block.total_watch_time == 2 * threads * calls
+
+
+class ClampingCounterStore(LocalCounterStore):
+    """Counter store that behaves like memcached: counters cannot be negative."""
+
+    def incr(self, key, delta):
+        with self._lock:
+            value = max(0, self._values.get(key, 0) + delta)
+            self._values[key] = value
+            return value
+
+
+def test_decrements_with_non_negative_store():
+    counters = AggregateCounters(ClampingCounterStore(), shards=2)
+    counters.incr('scope', 'like_count', 3)
+    counters.incr('scope', 'like_count', -1)
+    assert counters.pending('scope', ['like_count'], {}) == {'like_count': 2}
+    counts, cursors = counters.drain('scope', ['like_count'], {})
+    assert counts == {'like_count': 2}
+    counters.incr('scope', 'like_count', -2)
+    assert counters.pending('scope', ['like_count'], cursors) == {'like_count': -2}
+    counts, cursors = counters.drain('scope', ['like_count'], cursors)
+    assert counts == {'like_count': -2}
+    assert counters.drain('scope', ['like_count'], cursors)[0] == {'like_count': 0}
+
+
+def test_lost_store_does_not_count_twice():
+    """
+    Cursors are saved in the summary fields: when the counter store is
+    flushed, pending increments are lost, but compacted ones are not counted
+    again.
+    """
+    runtime = BenchmarkRuntime({'COUNTERS_BACKEND': 'local', 'COUNTERS_COMPACT_INTERVAL': 0.01})
+    usage_id = 'lost-store'
+    for index in range(3):
+        block = runtime.make_block(VideofrontXBlock, usage_id=usage_id, user_id='user-{}'.format(index))
+        post_json(block, 'like_dislike', {'voteType': 'like'})
+    block = compacted_block(runtime, usage_id)
+    assert block.like_count == 3
+    # Evict everything but the like counters
+    store = block.get_counters().store
+    with store._lock: # pylint: disable=protected-access
+        for key in list(store._values): # pylint: disable=protected-access
+            if ':like_count:' not in key:
+                del store._values[key] # pylint: disable=protected-access
+    block = compacted_block(runtime, usage_id)
+    assert block.like_count == 3
+    block = runtime.make_block(VideofrontXBlock, usage_id=usage_id, user_id='user-3')
+    post_json(block, 'like_dislike', {'voteType': 'like'})
+    block = compacted_block(runtime, usage_id)
+    assert block.like_count == 4
+
+
+def test_compaction_of_block_with_saved_fields():
+    runtime = BenchmarkRuntime({'COUNTERS_BACKEND': 'local', 'COUNTERS_COMPACT_INTERVAL': 0.01})
+    block = runtime.make_block(VideofrontXBlock, usage_id='saved-fields', total_views=100, like_count=3)
+    post_json(block, 'saveTotalWatchTime', {'watchTime': 2, 'watchDate': '2020-01-01'})
+    post_json(block, 'like_dislike', {'voteType': 'like'})
+    block = compacted_block(runtime, 'saved-fields')
+    assert block.total_views == 101
+    assert block.like_count == 4
+
+
+def test_rollups_of_past_periods(monkeypatch):
+    """
+    Increments of periods that ended several compactions ago are not lost.
+    """
+    runtime = BenchmarkRuntime({'COUNTERS_BACKEND': 'local', 'COUNTERS_COMPACT_INTERVAL': 0.01})
+    usage_id = 'past-rollups'
+    period_at = Rollups.period_at
+    now = time.time()
+
+    def record_views(days_ago, views):
+        monkeypatch.setattr(Rollups, 'period_at', lambda self, timestamp=None: period_at(self, now - days_ago * 86400))
+        for _ in range(views):
+            block = runtime.make_block(VideofrontXBlock, usage_id=usage_id)
+            post_json(block, 'saveTotalWatchTime', {'watchTime': 2, 'watchDate': '2020-01-01'})
+        monkeypatch.setattr(Rollups, 'period_at', period_at)
+
+    def views_series(block):
+        return [count for _start, count in block.get_rollups().series('views')]
+
+    record_views(5, 3)
+    record_views(0, 1)
+    pending = runtime.make_block(VideofrontXBlock, usage_id=usage_id).get_trends()[0]
+    assert pending['total'] == 4
+
+    block = compacted_block(runtime, usage_id)
+    assert views_series(block)[-6] == 3
+    assert views_series(block)[-1] == 1
+    assert block.get_trends()[0]['total'] == 4
+
+    record_views(5, 2)
+    block = compacted_block(runtime, usage_id)
+    assert views_series(block)[-6] == 5
+
+
+def test_rollup_storage_is_bounded(monkeypatch):
+    """
+    Counters of past periods are deleted once compacted.
+    """
+    runtime = BenchmarkRuntime({
+        'COUNTERS_BACKEND': 'local', 'COUNTERS_COMPACT_INTERVAL': 0.01,
+        'ROLLUP_PERIOD': 'hourly', 'ROLLUP_SIZE': 24,
+    })
+    usage_id = 'bounded-rollups'
+    period_at = Rollups.period_at
+    start = time.time()
+    sizes = []
+    for hour in range(14 * 24):
+        monkeypatch.setattr(Rollups, 'period_at', lambda self, timestamp=None, hour=hour: period_at(
+            self, start + hour * 3600 if timestamp is None else timestamp
+        ))
+        block = runtime.make_block(VideofrontXBlock, usage_id=usage_id)
+        post_json(block, 'saveTotalWatchTime', {'watchTime': 2, 'watchDate': '2020-01-01'})
+        block = compacted_block(runtime, usage_id)
+        store = block.get_counters().store
+        digest = hashlib.md5(usage_id.encode('utf8')).hexdigest()
+        sizes.append((len(block.counters_cursors), len([key for key in store._values if digest in key]))) # pylint: disable=protected-access
+    assert block.total_views == 14 * 24
+    assert sum(count for _start, count in block.get_rollups().series('views')) == 24
+    assert sizes[-1] == sizes[48]
@@ -0,0 +1,133 @@
+import csv
+import io
+import json
+import sys
+import threading
+import types
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from videofront_xblock import export
+from videofront_xblock.counters import AggregateCounters, LocalCounterStore
+
+
+def make_blocks(count):
+    return [
+        {'usage_id': 'block-{}'.format(index), 'display_name': 'Video {}'.format(index), 'video_id': 'v{}'.format(index)}
+        for index in range(count)
+    ]
+
+
+def load_fields(usage_ids):
+    return dict(
+        (usage_id, {
+            'total_views': int(usage_id.split('-')[1]),
+            'total_watch_time': 10 * int(usage_id.split('-')[1]),
+            'most_used_controls': "1,2,3",
+            'total_timeline': "",
+        })
+        for usage_id in usage_ids
+    )
+
+
+def test_iter_aggregates_keeps_order_and_batches():
+    queries = []
+    lock = threading.Lock()
+
+    def counting_load_fields(usage_ids):
+        with lock:
+            queries.append(len(usage_ids))
+        return load_fields(usage_ids)
+
+    records = list(export.iter_aggregates(
+        iter(make_blocks(150)), load_fields=counting_load_fields, workers=4, batch_size=64
+    ))
+    assert [record['usage_id'] for record in records] == ['block-{}'.format(index) for index in range(150)]
+    assert records[3]['total_views'] == 3
+    assert records[3]['avg_watch_time'] == 10
+    assert records[0]['avg_watch_time'] == 0
+    assert records[3]['controls']['Volume Change'] == 2
+    assert records[3]['controls']['Transcript Download'] == 0
+    # One query per chunk of a batch, at most one chunk per worker
+    assert sum(queries) == 150
+    assert len(queries) <= 3 * 4
+    assert max(queries) <= 16
+
+
+def test_iter_aggregates_adds_pending_counters():
+    counters = AggregateCounters(LocalCounterStore())
+    counters.incr('block-2', 'total_views', 5)
+    counters.incr('block-2', 'most_used_controls.0', 4)
+    records = list(export.iter_aggregates(make_blocks(3), load_fields=load_fields, counters=counters))
+    assert records[2]['total_views'] == 7
+    assert records[2]['controls']['Play/Pause'] == 5
+    assert records[1]['total_views'] == 1
+
+
+def test_write_jsonl():
+    output = io.StringIO()
+    export.write_jsonl(export.iter_aggregates(make_blocks(2), load_fields=load_fields), output)
+    lines = output.getvalue().splitlines()
+    assert len(lines) == 2
+    record = json.loads(lines[1])
+    assert record['usage_id'] == 'block-1'
+    assert record['heatmap'] == {'length': 0, 'width': 1, 'bins': []}
+
+
+def test_write_csv():
+    output = io.StringIO()
+    export.write_csv(export.iter_aggregates(make_blocks(2), load_fields=load_fields), output)
+    rows = list(csv.reader(io.StringIO(output.getvalue())))
+    assert tuple(rows[0]) == export.CSV_COLUMNS
+    assert len(rows) == 3
+    row = dict(zip(rows[0], rows[2]))
+    assert row['usage_id'] == 'block-1'
+    assert row['video_id'] == 'v1'
+    assert row['total_views'] == '1'
+    assert row['Playback Rate Change'] == '3'
+    assert row['heatmap'] == ''
+
+
+def test_load_summary_fields(monkeypatch):
+    queries = []
+
+    class UsageKey(object):
+        def __init__(self, usage_id):
+            self.usage_id = usage_id
+
+        @classmethod
+        def from_string(cls, usage_id):
+            return cls(usage_id)
+
+        def __str__(self):
+            return self.usage_id
+
+    class QuerySet(object):
+        def __init__(self, **filters):
+            queries.append(filters)
+
+        def values_list(self, *columns):
+            assert columns == ('usage_id', 'field_name', 'value')
+            return [
+                (UsageKey('block-0'), 'total_views', '3'),
+                (UsageKey('block-0'), 'most_used_controls', '"1,2"'),
+            ]
+
+    models = types.ModuleType('models')
+    models.XModuleUserStateSummaryField = mock.Mock(objects=mock.Mock(filter=QuerySet))
+    keys = types.ModuleType('keys')
+    keys.UsageKey = UsageKey
+    for name in ('lms', 'lms.djangoapps', 'lms.djangoapps.courseware', 'opaque_keys', 'opaque_keys.edx'):
+        monkeypatch.setitem(sys.modules, name, types.ModuleType(name))
+    monkeypatch.setitem(sys.modules, 'lms.djangoapps.courseware.models', models)
+    monkeypatch.setitem(sys.modules, 'opaque_keys.edx.keys', keys)
+
+    fields = export.load_summary_fields(['block-0', 'block-1'])
+
+    assert fields == {'block-0': {'total_views': 3, 'most_used_controls': '1,2'}, 'block-1': {}}
+    assert len(queries) == 1
+    assert [str(key) for key in queries[0]['usage_id__in']] == ['block-0', 'block-1']
+    assert set(queries[0]['field_name__in']) == set(export.SUMMARY_FIELDS)
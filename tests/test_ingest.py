@@ -0,0 +1,17 @@
+from benchmarks.runtime import BenchmarkRuntime, post_json
+from videofront_xblock import VideofrontXBlock
+
+
+def test_malformed_event_does_not_drop_batch():
+    block = BenchmarkRuntime({}).make_block(VideofrontXBlock)
+    results = post_json(block, 'ingest_events', {'events': [
+        {'type': 'watched', 'ranges': "not ranges", 'position': 10, 'duration': 60},
+        {'type': 'watch_time', 'watchTime': 42, 'watchDate': '2020-01-01'},
+        {'type': 'unknown'},
+        {'type': 'video_download'},
+    ]})['results']
+    assert results[0] is None
+    assert results[2] is None
+    assert block.total_views == 1
+    assert block.total_watch_time == 42
+    assert block.video_downloads == 1
@@ -0,0 +1,40 @@
+import json
+
+from webob import Request
+
+from benchmarks.runtime import BenchmarkRuntime
+from videofront_xblock import VideofrontXBlock
+from videofront_xblock.cache import get_metadata_cache
+
+
+def invalidate(block, video_id):
+    request = Request.blank(
+        '/', method='POST', body=json.dumps({'video_id': video_id}).encode('utf8'),
+        headers={'Authorization': 'Token secret'},
+    )
+    return block.runtime.handle(block, 'invalidate', request)
+
+
+def test_invalidate_requires_shared_cache():
+    runtime = BenchmarkRuntime({'HOST': 'http://videofront', 'INVALIDATION_TOKEN': 'secret'})
+    block = runtime.make_block(VideofrontXBlock)
+    assert invalidate(block, 'video').status_code == 409
+
+
+def test_invalidate_shared_cache():
+    settings = {
+        'HOST': 'http://videofront',
+        'INVALIDATION_TOKEN': 'secret',
+        'CACHE_BACKEND': 'django',
+        'BACKGROUND_REFRESH': False,
+    }
+    metadata_cache = get_metadata_cache(settings)
+    key = metadata_cache.make_key(settings['HOST'], 'invalidated')
+    metadata_cache.set(key, (200, {'subtitles': []}), 60)
+    assert metadata_cache.backend.get(key) is not None
+    block = BenchmarkRuntime(settings).make_block(VideofrontXBlock)
+
+    response = invalidate(block, 'invalidated')
+
+    assert response.status_code == 200
+    assert metadata_cache.backend.get(key) is None
@@ -0,0 +1,18 @@
+import os
+
+from videofront_xblock.metrics import PrometheusSink
+
+
+def test_prometheus_file_per_process(tmpdir):
+    pid = str(os.getpid())
+    sink = PrometheusSink('videofront_xblock', path=str(tmpdir.join('videofront.prom')))
+    sink.timing('handler', 20, {'handler': 'manifest'}, 1)
+    sink.dump()
+
+    content = tmpdir.join('videofront.{}.prom'.format(pid)).read()
+    assert 'videofront_xblock_handler_seconds_count{handler="manifest",pid="' + pid + '"} 1.0' in content
+
+
+def test_prometheus_pid_placeholder(tmpdir):
+    sink = PrometheusSink('videofront_xblock', path=str(tmpdir.join('{pid}', 'videofront.prom')))
+    assert sink.get_path() == str(tmpdir.join(str(os.getpid()), 'videofront.prom'))
@@ -0,0 +1,156 @@
+"""
+Static assets of the XBlock.
+
+The CSS and JS resources that are added to every fragment can either be
+inlined, or served as minified, content-hashed files from `public/dist`. The
+latter are generated by:
+
+    python videofront_xblock/assets.py
+
+They are also generated when building the package. Because their names
+depend on the content of the sources, they can be cached by browsers for a
+long time.
+
+This module must not import anything outside of the standard library at
+module level, such that `setup.py` can run it before the dependencies are
+installed: pkg_resources, which recent build environments lack, is only
+imported to serve resources, and the minifiers are build requirements.
+"""
+import hashlib
+import io
+import os
+import re
+import sys
+
+PACKAGE = 'videofront_xblock'
+DIST_DIR = 'public/dist'
+
+# Static resources that are bundled in every fragment, in order
+CSS_RESOURCES = (
+    'public/css/xblock.css',
+    'public/css/vendor/videojs-resolution-switcher.css',
+    'public/css/vendor/videojs-seek-buttons.css',
+    'public/css/vendor/videojs-vtt-thumbnails.css',
+)
+JS_RESOURCES = (
+    'public/js/xblock.js',
+    'public/js/vendor/videojs-resolution-switcher.js',
+    'public/js/vendor/videojs-seek-buttons.min.js',
+    'public/js/vendor/videojs-vtt-thumbnails.min.js',
+)
+CSS_SEPARATOR = u"\n"
+# Scripts are separated by semicolons in case one of them does not end with a
+# complete statement
+JS_SEPARATOR = u"\n;\n"
+# Browsers ignore `@import` rules that are not at the top of a stylesheet
+CSS_IMPORT = re.compile(r"""@import\s+(?:url\([^)]*\)|"[^"]*"|'[^']*')[^;]*;""")
+
+# Resources and bundles are loaded once per process
+_resources = {}
+
+
+def load_resource(path):
+    """Decoded content of a package resource."""
+    import pkg_resources
+    data = _resources.get(path)
+    if data is None:
+        data = _resources[path] = pkg_resources.resource_string(PACKAGE, path).decode('utf8')
+    return data
+
+
+def concatenate(contents, separator):
+    """
+    Join resources. The `@import` rules of stylesheets are moved to the top
+    of the bundle, where they are still valid.
+    """
+    if separator != CSS_SEPARATOR:
+        return separator.join(contents)
+    imports = []
+
+    def hoist(match):
+        imports.append(match.group(0))
+        return u""
+
+    contents = [CSS_IMPORT.sub(hoist, content) for content in contents]
+    return separator.join(imports + contents)
+
+
+def load_bundle(paths, separator):
+    """Concatenation of package resources."""
+    key = (paths, separator)
+    data = _resources.get(key)
+    if data is None:
+        data = _resources[key] = concatenate([load_resource(path) for path in paths], separator)
+    return data
+
+
+def bundle_name(content, extension):
+    """
+    Name of the minified bundle built from `content`. It only depends on the
+    sources, such that it can be computed at runtime without minifying.
+    """
+    digest = hashlib.sha1(content.encode('utf8')).hexdigest()[:12]
+    return 'videofront-xblock.{}.min.{}'.format(digest, extension)
+
+
+def get_bundle_path(paths, separator, extension):
+    """
+    Returns:
+        path (str): resource path of the minified bundle, or None if it was
+        not built for the current sources.
+    """
+    import pkg_resources
+    key = ('dist', paths)
+    if key not in _resources:
+        path = DIST_DIR + '/' + bundle_name(load_bundle(paths, separator), extension)
+        _resources[key] = path if pkg_resources.resource_exists(PACKAGE, path) else None
+    return _resources[key]
+
+
+def minify_css(content):
+    import rcssmin
+    return rcssmin.cssmin(content)
+
+
+def minify_js(content):
+    import rjsmin
+    return rjsmin.jsmin(content)
+
+
+def build(package_dir=None):
+    """
+    Write the minified CSS and JS bundles to `public/dist`, removing previous
+    bundles.
+
+    Returns:
+        paths (list): paths of the generated files
+    """
+    package_dir = package_dir or os.path.dirname(os.path.abspath(__file__))
+
+    def read(path):
+        with io.open(os.path.join(package_dir, path), encoding='utf8') as f:
+            return f.read()
+
+    dist_dir = os.path.join(package_dir, DIST_DIR)
+    if not os.path.exists(dist_dir):
+        os.makedirs(dist_dir)
+    for name in os.listdir(dist_dir):
+        if name.startswith('videofront-xblock.'):
+            os.remove(os.path.join(dist_dir, name))
+
+    generated = []
+    for paths, separator, extension, minify in (
+            (CSS_RESOURCES, CSS_SEPARATOR, 'css', minify_css),
+            (JS_RESOURCES, JS_SEPARATOR, 'js', minify_js),
+    ):
+        content = concatenate([read(path) for path in paths], separator)
+        dist_path = os.path.join(dist_dir, bundle_name(content, extension))
+        with io.open(dist_path, 'w', encoding='utf8') as f:
+            f.write(minify(content))
+        generated.append(dist_path)
+    return generated
+
+
+if __name__ == '__main__':
+    for generated_path in build(*sys.argv[1:]):
+        print(generated_path)
@@ -0,0 +1,308 @@
+"""
+Caches for Videofront API responses.
+
+Storage is delegated to a backend: either `VideoCache`, which lives in the
+current process, or `DjangoCache`, which goes through the Django cache
+framework and can thus be shared by all workers (memcached, redis, file-based
+cache...). `MetadataCache` sits on top of a backend and adds stale-while-
+revalidate semantics with single-flight refreshes.
+"""
+from collections import OrderedDict
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class VideoCache(object):
+    """
+    Bounded LRU cache where every entry carries its own time-to-live.
+
+    Entries are evicted when they expire or, once `max_entries` is reached,
+    in least-recently-used order. Hit, miss and eviction counters are kept so
+    that the cache can be sized from production figures (see `stats`).
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for `key`, or `default` if the key is missing
+        or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            # Move to the most-recently-used end
+            del self._entries[key]
+            self._entries[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout):
+        """
+        Store `value` for `timeout` seconds. A non-positive timeout removes
+        the key instead.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            if timeout <= 0:
+                return
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._entries[key] = (time.time() + timeout, value)
+
+    def add(self, key, value, timeout):
+        """
+        Store `value` only if `key` is not already cached.
+
+        Returns:
+            added (bool): True if the value was stored.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                return False
+        # There is a tiny window between the check and the write, but `add`
+        # is only used to elect a refreshing thread, where a rare duplicate
+        # refresh is harmless.
+        self.set(key, value, timeout)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Returns:
+            stats (dict): current size and hit/miss/eviction counters.
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class DjangoCache(object):
+    """
+    Backend that stores entries in one of the caches declared in the Django
+    `CACHES` setting. This is the backend to use for sharing entries among
+    workers.
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        # Imported here such that the module can be used outside of Django
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, key, default=None):
+        return self.cache.get(key, default)
+
+    def set(self, key, value, timeout):
+        if timeout <= 0:
+            self.cache.delete(key)
+        else:
+            self.cache.set(key, value, timeout)
+
+    def add(self, key, value, timeout):
+        return self.cache.add(key, value, timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def stats(self):
+        return {'alias': self.alias}
+
+
+class MetadataCache(object):
+    """
+    Serve cached values with stale-while-revalidate semantics.
+
+    A value is fresh for the timeout returned by the fetch function. After
+    that it is kept for another `stale_ttl` seconds, during which a single
+    caller (elected through an atomic `add` on a lock key) refreshes it while
+    all other callers keep receiving the stale value. This prevents a
+    thundering herd of upstream requests when a popular entry expires.
+    """
+
+    # Maximum time (in seconds) that a refresh lock is held
+    lock_timeout = 10
+    # When there is no value at all, time to wait for another worker to fetch
+    # it before fetching it ourselves
+    wait_timeout = 2
+    wait_interval = 0.05
+
+    def __init__(self, backend, stale_ttl=300):
+        self.backend = backend
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Build a key that is valid for all backends, including memcached
+        (no whitespace, bounded length).
+        """
+        digest = hashlib.md5(u"/".join(parts).encode('utf8')).hexdigest()
+        return 'videofront-xblock:' + digest
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Args:
+            key (str): as returned by `make_key`
+            fetch (callable): returns a `(value, timeout)` tuple. Values with
+            a non-positive timeout are returned but not cached. A `None`
+            timeout means the fetch failed: the stale value, if any, is
+            returned instead.
+        Returns:
+            value
+        """
+        entry = self.backend.get(key)
+        if entry is not None and entry['fresh_until'] > time.time():
+            self.hits += 1
+            return entry['value']
+
+        # Coalesce the threads of this process first, then the workers. When
+        # there is a stale value, threads do not wait for the refresh.
+        local_lock = self._get_local_lock(key)
+        if entry is not None:
+            if not local_lock.acquire(False):
+                self.stale_hits += 1
+                return entry['value']
+        else:
+            local_lock.acquire()
+        try:
+            entry = self.backend.get(key)
+            if entry is not None and entry['fresh_until'] > time.time():
+                self.hits += 1
+                return entry['value']
+            lock_key = key + ':lock'
+            if not self.backend.add(lock_key, 1, self.lock_timeout):
+                if entry is not None:
+                    self.stale_hits += 1
+                    return entry['value']
+                entry = self._wait_for(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry['value']
+                lock_key = None
+            self.misses += 1
+            try:
+                value, timeout = fetch()
+                if timeout is None:
+                    if entry is not None:
+                        logger.warning("Serving stale value for %s", key)
+                        return entry['value']
+                elif timeout > 0:
+                    self.set(key, value, timeout)
+                return value
+            finally:
+                if lock_key is not None:
+                    self.backend.delete(lock_key)
+        finally:
+            local_lock.release()
+
+    def is_fresh(self, key):
+        entry = self.backend.get(key)
+        return entry is not None and entry['fresh_until'] > time.time()
+
+    def set(self, key, value, timeout):
+        self.backend.set(
+            key,
+            {'value': value, 'fresh_until': time.time() + timeout},
+            timeout + self.stale_ttl
+        )
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def stats(self):
+        stats = {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+        }
+        stats['backend'] = self.backend.stats()
+        return stats
+
+    def _get_local_lock(self, key):
+        with self._locks_lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                if len(self._locks) > 10000:
+                    self._locks.clear()
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _wait_for(self, key):
+        deadline = time.time() + self.wait_timeout
+        while time.time() < deadline:
+            time.sleep(self.wait_interval)
+            entry = self.backend.get(key)
+            if entry is not None:
+                return entry
+        return None
+
+
+_metadata_caches = {}
+
+
+def get_metadata_cache(settings):
+    """
+    Return the metadata cache configured in the settings bucket. Caches are
+    created once per process.
+
+    Relevant settings:
+        CACHE_BACKEND: 'local' (default) or 'django'
+        CACHE_ALIAS: Django cache alias, for the 'django' backend
+        CACHE_MAX_ENTRIES: size of the 'local' backend
+        CACHE_STALE_TTL: how long stale values may be served during refreshes
+    """
+    backend_name = settings.get('CACHE_BACKEND', 'local')
+    alias = settings.get('CACHE_ALIAS', 'default')
+    config = (backend_name, alias)
+    metadata_cache = _metadata_caches.get(config)
+    if metadata_cache is None:
+        if backend_name == 'django':
+            backend = DjangoCache(alias)
+        elif backend_name == 'local':
+            backend = VideoCache(max_entries=settings.get('CACHE_MAX_ENTRIES', 1024))
+        else:
+            raise ValueError("Unknown Videofront cache backend: {}".format(backend_name))
+        metadata_cache = MetadataCache(backend, stale_ttl=settings.get('CACHE_STALE_TTL', 300))
+        _metadata_caches[config] = metadata_cache
+    return metadata_cache
@@ -0,0 +1,332 @@
+"""
+HTTP client for the Videofront API.
+
+The API can be served by several hosts, e.g. one per region: requests go to
+the fastest healthy host, and fail over to the others. Video files can be
+served by mirrors of the storage host in the same way.
+"""
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from .refresh import RefreshScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised instead of performing a request while the circuit breaker is open.
+    It inherits from `ConnectionError` such that callers handle it like an
+    unreachable server.
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Stop sending requests to a server after `failure_threshold` consecutive
+    failures. After `reset_timeout` seconds, a single trial request is let
+    through ("half-open" state): the circuit is closed again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow_request(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_timeout:
+                # Let one request through; further ones wait for its outcome
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def trip(self):
+        """Open the circuit right away."""
+        with self._lock:
+            self.failures = max(self.failures, self.failure_threshold)
+            self.opened_at = time.time()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("Videofront circuit breaker opened after %d failures", self.failures)
+                self.opened_at = time.time()
+
+
+class HostSelector(object):
+    """
+    Track the health and the latency of equivalent hosts, and rank them.
+
+    Each host has its own circuit breaker. Latencies are measured by
+    periodic probes (a HEAD request on `probe_path`), in the background, and
+    smoothed with an exponential moving average. A failed probe opens the
+    circuit of a host right away; a successful one closes it, such that a
+    host that is back is used again without waiting for `reset_timeout`.
+    """
+    # Weight of the latest probe in the moving average
+    SMOOTHING = 0.3
+
+    def __init__(self, hosts, probe_path='/', probe_timeout=2,
+                 failure_threshold=5, reset_timeout=30):
+        self.hosts = list(hosts)
+        self.probe_path = probe_path
+        self.probe_timeout = probe_timeout
+        self.breakers = dict(
+            (host, CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout))
+            for host in self.hosts
+        )
+        self.latencies = {}
+        self.session = requests.Session()
+        self.scheduler = None
+
+    def ranked(self):
+        """
+        Returns:
+            hosts (list): hosts with a closed circuit first, by increasing
+            latency. Hosts that were not probed yet keep their configuration
+            order.
+        """
+        return sorted(self.hosts, key=lambda host: (
+            self.breakers[host].is_open,
+            self.latencies.get(host, float('inf')),
+            self.hosts.index(host),
+        ))
+
+    def best(self):
+        return self.ranked()[0]
+
+    def probe(self):
+        """
+        Measure the latency of every host.
+
+        Returns:
+            again (bool): always True, such that the scheduler keeps probing.
+        """
+        for host in self.hosts:
+            start = time.time()
+            try:
+                response = self.session.head(
+                    host + self.probe_path, timeout=self.probe_timeout, allow_redirects=False
+                )
+            except requests.RequestException as e:
+                failed = e
+            else:
+                failed = response.status_code >= 500 and response.status_code
+            breaker = self.breakers[host]
+            if failed:
+                if not breaker.is_open:
+                    logger.warning("Videofront host %s failed its probe: %s", host, failed)
+                breaker.trip()
+                continue
+            breaker.record_success()
+            latency = time.time() - start
+            previous = self.latencies.get(host)
+            self.latencies[host] = latency if previous is None else (
+                self.SMOOTHING * latency + (1 - self.SMOOTHING) * previous
+            )
+        return True
+
+    def schedule_probes(self, interval):
+        """
+        Probe the hosts right away, then every `interval` seconds. Probes run
+        in a thread of their own: they must neither wait for slow metadata
+        refreshes, nor delay them, nor wait for the probes of other selectors,
+        which take up to `probe_timeout` per host that is down.
+        """
+        if self.scheduler is None:
+            self.scheduler = RefreshScheduler(name='videofront-xblock-probes')
+        self.scheduler.schedule(
+            'probe', self.probe, delay=0, max_delay=interval, timeout=float('inf'),
+        )
+
+
+class VideofrontClient(object):
+    """
+    Videofront API client that reuses a pooled `requests.Session` across
+    renders, with bounded timeouts and retries, and a circuit breaker per
+    host. When several hosts are configured, requests go to the best ranked
+    one (see `HostSelector`) and fail over to the next ones on connection
+    errors and 5xx responses.
+    """
+
+    def __init__(self, host, token, connect_timeout=3.05, read_timeout=10,
+                 retries=2, backoff_factor=0.3, pool_size=10,
+                 failure_threshold=5, reset_timeout=30,
+                 hosts=(), probe_interval=30, probe_timeout=2):
+        self.host = host
+        self.token = token
+        self.timeout = (connect_timeout, read_timeout)
+        self.selector = HostSelector(
+            [host] + [other for other in hosts if other != host],
+            probe_path='/api/v1/', probe_timeout=probe_timeout,
+            failure_threshold=failure_threshold, reset_timeout=reset_timeout,
+        )
+        if len(self.selector.hosts) > 1:
+            self.selector.schedule_probes(probe_interval)
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = 'Token ' + token
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, path):
+        """
+        Perform a GET request on the API.
+
+        Returns:
+            response: the first response that is not a 5xx error or, if all
+            hosts failed, the last 5xx response.
+        Raises:
+            requests.ConnectionError: no host could be reached, or all circuit
+            breakers are open.
+            requests.Timeout
+        """
+        response = None
+        error = None
+        for host in self.selector.ranked():
+            breaker = self.selector.breakers[host]
+            if not breaker.allow_request():
+                continue
+            if response is not None or error is not None:
+                logger.warning("Failing over to Videofront host %s", host)
+            try:
+                response = self.session.get(host + path, timeout=self.timeout)
+            except requests.RequestException as e:
+                breaker.record_failure()
+                error = e
+                continue
+            if response.status_code < 500:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+        if response is not None:
+            return response
+        if error is not None:
+            raise error
+        raise CircuitOpenError("Videofront circuit breaker is open for {}".format(", ".join(self.selector.hosts)))
+
+    def get_video(self, video_id):
+        return self.get('/api/v1/videos/{}/'.format(video_id))
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(settings):
+    """
+    Return the client configured in the settings bucket. Clients, and thus
+    their connection pools, are created once per process.
+
+    Relevant settings:
+        HOST, TOKEN
+        HOSTS: other hosts that serve the same API, e.g. in other regions
+        HOSTS_PROBE_INTERVAL: time (in seconds) between two latency probes
+        HOSTS_PROBE_TIMEOUT: in seconds
+        CONNECT_TIMEOUT, READ_TIMEOUT: in seconds
+        RETRIES: number of retries on connection errors and 502/503/504
+        RETRY_BACKOFF: backoff factor between retries, in seconds
+        POOL_SIZE: maximum number of connections kept open
+        CIRCUIT_FAILURE_THRESHOLD: consecutive failures that open the circuit
+        CIRCUIT_RESET_TIMEOUT: time (in seconds) before retrying a server
+    """
+    kwargs = {
+        'host': settings['HOST'],
+        'token': settings['TOKEN'],
+        'connect_timeout': settings.get('CONNECT_TIMEOUT', 3.05),
+        'read_timeout': settings.get('READ_TIMEOUT', 10),
+        'retries': settings.get('RETRIES', 2),
+        'backoff_factor': settings.get('RETRY_BACKOFF', 0.3),
+        'pool_size': settings.get('POOL_SIZE', 10),
+        'failure_threshold': settings.get('CIRCUIT_FAILURE_THRESHOLD', 5),
+        'reset_timeout': settings.get('CIRCUIT_RESET_TIMEOUT', 30),
+        'hosts': tuple(settings.get('HOSTS', ())),
+        'probe_interval': settings.get('HOSTS_PROBE_INTERVAL', 30),
+        'probe_timeout': settings.get('HOSTS_PROBE_TIMEOUT', 2),
+    }
+    config = tuple(sorted(kwargs.items()))
+    with _clients_lock:
+        client = _clients.get(config)
+        if client is None:
+            client = _clients[config] = VideofrontClient(**kwargs)
+    return client
+
+
+_mirrors = {}
+
+
+def get_mirrors(settings):
+    """
+    Return the host selectors of the storage hosts that have mirrors, as
+    configured by the `MIRRORS` setting: a dict of origins, e.g.
+    "https://cdn.example.com", to their lists of mirrors. Selectors are
+    created, and start probing, once per process.
+
+    Returns:
+        mirrors (list): `(origin, selector)` tuples
+    """
+    mirrors = settings.get('MIRRORS')
+    if not mirrors:
+        return []
+    config = (
+        tuple(sorted((origin, tuple(hosts)) for origin, hosts in mirrors.items())),
+        settings.get('HOSTS_PROBE_INTERVAL', 30),
+        settings.get('HOSTS_PROBE_TIMEOUT', 2),
+    )
+    with _clients_lock:
+        selectors = _mirrors.get(config)
+        if selectors is None:
+            selectors = _mirrors[config] = []
+            for origin, hosts in config[0]:
+                selector = HostSelector(
+                    (origin,) + hosts, probe_timeout=config[2],
+                    failure_threshold=settings.get('CIRCUIT_FAILURE_THRESHOLD', 5),
+                    reset_timeout=settings.get('CIRCUIT_RESET_TIMEOUT', 30),
+                )
+                selector.schedule_probes(config[1])
+                selectors.append((origin, selector))
+    return selectors
+
+
+def rewrite_url(mirrors, url):
+    """
+    Args:
+        mirrors (list): as returned by `get_mirrors`
+    Returns:
+        url (str): `url` on the best ranked mirror of its origin, if any.
+    """
+    for origin, selector in mirrors:
+        if url.startswith(origin + '/'):
+            return selector.best() + url[len(origin):]
+    return url
@@ -0,0 +1,376 @@
+"""
+Contention-free aggregates for `Scope.user_state_summary` fields.
+
+Summary fields are shared by all the learners of a block: when they are
+updated with a read-modify-write in every handler call, concurrent updates
+are lost. Instead, handlers record their deltas in a counter store, where
+they are applied with atomic operations:
+
+* counters are incremented in one of several shards, picked at random, such
+  that concurrent increments do not all hit the same key. Counters never
+  decrease: decrements are counted separately, and compactions move
+  cursors instead of decrementing. Cursors are saved along with the summary
+  fields, not in the store: losing the store loses pending deltas, but never
+  counts them twice;
+* deltas that are not counters (e.g: timeline increments) are appended to a
+  log, where each entry gets its own key.
+
+Deltas are periodically compacted into the summary fields by a single
+handler call per block (see `VideofrontXBlock.compact_aggregates`).
+"""
+import hashlib
+import random
+import threading
+import time
+
+KEY_PREFIX = 'videofront-xblock:counters:'
+# Time (in seconds) after which a compaction that did not complete is
+# considered to have crashed
+CLAIM_TIMEOUT = 300
+
+
+class LocalCounterStore(object):
+    """
+    Counter store that lives in the current process. Counts are never
+    evicted, but they are not shared among workers.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def _expire(self, key):
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+
+    def get_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._expire(key)
+            return dict((key, self._values[key]) for key in keys if key in self._values)
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            self._expire(key)
+            if key in self._values:
+                return False
+            self._values[key] = value
+            if timeout is not None:
+                self._expires[key] = time.time() + timeout
+            return True
+
+    def incr(self, key, delta):
+        with self._lock:
+            value = self._values.get(key, 0) + delta
+            self._values[key] = value
+            return value
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+                self._expires.pop(key, None)
+
+
+class DjangoCounterStore(object):
+    """
+    Counter store backed by one of the Django caches, shared by all workers.
+    The cache must support atomic `incr` and `add`, like memcached and redis
+    do.
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        # Imported here such that the module can be used outside of Django
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def set(self, key, value):
+        self.cache.set(key, value, None)
+
+    def add(self, key, value, timeout=None):
+        return self.cache.add(key, value, timeout)
+
+    def incr(self, key, delta):
+        """
+        `delta` must be positive: memcached clamps decrements at 0.
+        """
+        try:
+            value = self.cache.incr(key, delta)
+        except ValueError:
+            value = None
+        if value is None:
+            # Missing key: create it, unless another worker just did
+            if self.cache.add(key, delta, None):
+                return delta
+            value = self.cache.incr(key, delta)
+        return value
+
+    def delete_many(self, keys):
+        self.cache.delete_many(keys)
+
+
+class AggregateCounters(object):
+    """
+    Sharded counters and append-only delta logs, namespaced by a scope key
+    (the usage id of a block).
+    """
+
+    def __init__(self, store, shards=4, compact_interval=60):
+        self.store = store
+        self.shards = shards
+        self.compact_interval = compact_interval
+
+    def _key(self, scope, *parts):
+        digest = hashlib.md5(u"{}".format(scope).encode('utf8')).hexdigest()
+        return KEY_PREFIX + digest + ':' + ':'.join(str(part) for part in parts)
+
+    def incr(self, scope, name, delta=1):
+        """
+        Stores only ever increment counters: decrements, which are rare, are
+        counted in a shard of their own. Memcached, for instance, cannot store
+        negative values, and clamps decrements at 0.
+        """
+        if delta > 0:
+            self.store.incr(self._key(scope, name, random.randrange(self.shards)), delta)
+        elif delta < 0:
+            self.store.incr(self._key(scope, name, 'down'), -delta)
+
+    def _read(self, scope, names, cursors):
+        """
+        Args:
+            cursors (dict): value of each shard of each counter at the latest
+            compaction, by counter name, then by shard.
+        Returns:
+            shards (list): `(name, shard, value, pending count)` tuples
+        """
+        shards = [(name, str(shard)) for name in names for shard in range(self.shards)]
+        shards += [(name, 'down') for name in names]
+        keys = [self._key(scope, name, shard) for name, shard in shards]
+        values = self.store.get_many(keys)
+        result = []
+        for (name, shard), key in zip(shards, keys):
+            value = values.get(key, 0)
+            cursor = cursors.get(name, {}).get(shard, 0)
+            if cursor > value:
+                # The counter was evicted from the store
+                cursor = 0
+            count = value - cursor
+            result.append((name, shard, value, -count if shard == 'down' else count))
+        return result
+
+    def pending(self, scope, names, cursors):
+        """
+        Returns:
+            counts (dict): sum of the uncompacted increments of each counter.
+        """
+        counts = dict((name, 0) for name in names)
+        for name, _shard, _value, count in self._read(scope, names, cursors):
+            counts[name] += count
+        return counts
+
+    def append(self, scope, name, delta):
+        """
+        Append a delta to a log. The delta must be serializable by the
+        store.
+        """
+        position = self.store.incr(self._key(scope, name, 'length'), 1)
+        self.store.set(self._key(scope, name, 'log', position), delta)
+
+    def mark(self, scope, name, member):
+        """
+        Add a member to a set, e.g. the periods that have pending counts.
+        Members are appended to a log the first time they are added after a
+        compaction, such that the set costs a single `add` per call.
+        """
+        if self.store.add(self._key(scope, name, 'member', member), 1):
+            self.append(scope, name, member)
+
+    def marked(self, scope, name):
+        """
+        Returns:
+            members (list): members of a set, sorted.
+        """
+        return sorted(set(self._read_log(scope, name)[2]))
+
+    def try_lock(self, scope):
+        """
+        Elect the caller that compacts the deltas of `scope`. The lock is
+        never released: it expires after `compact_interval` seconds, which
+        limits compactions to one per interval.
+        """
+        return self.store.add(self._key(scope, 'compaction'), 1, self.compact_interval)
+
+    def get_generation(self, scope, default):
+        """
+        Number of compactions that were applied to the summary fields of
+        `scope`. It is initialized to `default` when missing (e.g: after the
+        cache was flushed).
+        """
+        key = self._key(scope, 'generation')
+        generation = self.store.get_many([key]).get(key)
+        if generation is None:
+            self.store.add(key, default, None)
+            generation = self.store.get_many([key]).get(key, default)
+        return generation
+
+    def claim_generation(self, scope, generation):
+        """
+        Elect the single caller that applies the compaction that follows
+        `generation`. Compactions can overlap when one of them takes longer
+        than `compact_interval`: without this, both would save summary
+        fields computed from the same generation, and one would be lost. The
+        claim expires, such that a compaction that crashed does not block the
+        next ones forever.
+        """
+        return self.store.add(
+            self._key(scope, 'claim', generation), 1, max(self.compact_interval, CLAIM_TIMEOUT)
+        )
+
+    def set_generation(self, scope, generation):
+        self.store.set(self._key(scope, 'generation'), generation)
+        # Compactions from older generations are rejected by the generation
+        # check: their claims are not needed anymore
+        self.store.delete_many([self._key(scope, 'claim', generation - 2)])
+
+    def drain(self, scope, names, cursors):
+        """
+        Mark the pending counts as compacted, by moving the cursors of the
+        counters. Must only be called by the caller that holds the compaction
+        lock, which must save the new cursors along with the counts.
+
+        Returns:
+            counts (dict): drained count of each counter.
+            cursors (dict): new cursors.
+        """
+        counts = dict((name, 0) for name in names)
+        cursors = dict((name, dict(shards)) for name, shards in cursors.items())
+        for name, shard, value, count in self._read(scope, names, cursors):
+            # Increments that happen in the meantime are beyond the cursor:
+            # they are kept for the next compaction. Cursors of evicted
+            # counters are moved back.
+            if value != cursors.get(name, {}).get(shard, 0):
+                cursors.setdefault(name, {})[shard] = value
+            counts[name] += count
+        return counts, cursors
+
+    def delete(self, scope, names, cursors):
+        """
+        Delete counters that will not be incremented anymore, e.g. those of
+        past periods, once they were drained. Must only be called by the
+        caller that holds the compaction lock.
+
+        Returns:
+            cursors (dict): cursors, without those of the deleted counters.
+        """
+        self.store.delete_many([
+            self._key(scope, name, shard) for name in names for shard in list(range(self.shards)) + ['down']
+        ])
+        names = set(names)
+        return dict((name, shards) for name, shards in cursors.items() if name not in names)
+
+    def _read_log(self, scope, name):
+        """
+        Returns:
+            cursor (int): position of the latest drained entry
+            keys (list): keys of the entries that follow the cursor
+            deltas (list): values of these entries, up to the first entry that
+            was reserved but not written yet.
+        """
+        length_key = self._key(scope, name, 'length')
+        cursor_key = self._key(scope, name, 'cursor')
+        values = self.store.get_many([length_key, cursor_key])
+        length = values.get(length_key, 0)
+        cursor = values.get(cursor_key, 0)
+        if length <= cursor:
+            return cursor, [], []
+        entry_keys = [self._key(scope, name, 'log', position) for position in range(cursor + 1, length + 1)]
+        entries = self.store.get_many(entry_keys)
+        deltas = []
+        for key in entry_keys:
+            if key not in entries:
+                break
+            deltas.append(entries[key])
+        return cursor, entry_keys, deltas
+
+    def drain_log(self, scope, name):
+        """
+        Remove the entries of a log. Must only be called by the caller that
+        holds the compaction lock.
+
+        Returns:
+            deltas (list): log entries, in order.
+        """
+        cursor, entry_keys, deltas = self._read_log(scope, name)
+        if not deltas:
+            return []
+        self.store.set(self._key(scope, name, 'cursor'), cursor + len(deltas))
+        self.store.delete_many(entry_keys[:len(deltas)])
+        return deltas
+
+    def drain_marks(self, scope, name):
+        """
+        Empty a set. Must only be called by the caller that holds the
+        compaction lock, before it drains the counters of the members: a
+        member that is added again in the meantime is kept for the next
+        compaction.
+
+        Returns:
+            members (list): members of the set, sorted.
+        """
+        members = sorted(set(self.drain_log(scope, name)))
+        self.store.delete_many([self._key(scope, name, 'member', member) for member in members])
+        return members
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def get_counters(settings):
+    """
+    Return the aggregate counters configured in the settings bucket, or None
+    if summary fields should be updated directly.
+
+    Relevant settings:
+        COUNTERS_BACKEND: None (default), 'local' or 'django'
+        COUNTERS_ALIAS: Django cache alias, for the 'django' backend
+        COUNTERS_SHARDS: number of shards per counter
+        COUNTERS_COMPACT_INTERVAL: minimum time (in seconds) between two
+        compactions of the same block
+    """
+    backend_name = settings.get('COUNTERS_BACKEND')
+    if not backend_name:
+        return None
+    config = (
+        backend_name,
+        settings.get('COUNTERS_ALIAS', 'default'),
+        settings.get('COUNTERS_SHARDS', 4),
+        settings.get('COUNTERS_COMPACT_INTERVAL', 60),
+    )
+    with _counters_lock:
+        counters = _counters.get(config)
+        if counters is None:
+            if backend_name == 'django':
+                store = DjangoCounterStore(config[1])
+            elif backend_name == 'local':
+                store = LocalCounterStore()
+            else:
+                raise ValueError("Unknown Videofront counters backend: {}".format(backend_name))
+            counters = _counters[config] = AggregateCounters(
+                store, shards=config[2], compact_interval=config[3]
+            )
+    return counters
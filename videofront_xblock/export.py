@@ -0,0 +1,218 @@
+"""
+Export the analytics of all the Videofront XBlocks of a course.
+
+Aggregates are read from the summary-scoped fields (and the pending aggregate
+counters, if enabled) without rendering any view. Blocks are streamed through
+a generator pipeline and processed in bounded batches on a thread pool, such
+that memory usage does not depend on the number of blocks.
+
+This must run in an LMS environment, e.g:
+
+    DJANGO_SETTINGS_MODULE=lms.envs.production python -m videofront_xblock.export \\
+        course-v1:org+course+run --format csv --output analytics.csv
+"""
+import argparse
+import csv
+from itertools import islice
+import json
+from multiprocessing.pool import ThreadPool
+import sys
+
+from . import timeline as timeline_encoding
+from .counters import get_counters
+from .summary import CONTROLS, COUNTERS as SUMMARY_COUNTERS, control_counter_name, decode_controls, get_counter_names
+
+BLOCK_TYPE = 'videofront-xblock'
+SUMMARY_FIELDS = SUMMARY_COUNTERS + ('most_used_controls', 'total_timeline', 'timeline_heatmap', 'counters_cursors')
+CSV_COLUMNS = (
+    ('usage_id', 'display_name', 'video_id') + SUMMARY_COUNTERS + ('avg_watch_time',) + CONTROLS + ('heatmap',)
+)
+
+
+def iter_course_blocks(course_key):
+    """
+    Walk the course tree one block at a time, such that only the locations
+    that remain to be visited are kept in memory, instead of the descriptors
+    of all the blocks.
+
+    Yields:
+        block (dict): `usage_id`, `display_name` and `video_id` of each
+        Videofront XBlock of the course.
+    """
+    from xmodule.modulestore.django import modulestore # pylint: disable=import-error
+    store = modulestore()
+    with store.bulk_operations(course_key):
+        locations = [store.get_course(course_key, depth=0).location]
+        while locations:
+            item = store.get_item(locations.pop(), depth=0)
+            if item.location.block_type == BLOCK_TYPE:
+                yield {
+                    'usage_id': u"{}".format(item.location),
+                    'display_name': u"{}".format(item.display_name),
+                    'video_id': (item.video_id or "").strip(),
+                }
+            # Depth-first, in course order
+            locations.extend(reversed(item.children if item.has_children else []))
+
+
+def load_summary_fields(usage_ids):
+    """
+    Returns:
+        fields (dict): decoded values of the summary fields that were saved
+        for each block, by usage id.
+    """
+    # Fields of the `user_state_summary` scope are stored by usage id
+    try:
+        from lms.djangoapps.courseware.models import XModuleUserStateSummaryField # pylint: disable=import-error
+    except ImportError:
+        from courseware.models import XModuleUserStateSummaryField # pylint: disable=import-error
+    from opaque_keys.edx.keys import UsageKey # pylint: disable=import-error
+    fields = dict((usage_id, {}) for usage_id in usage_ids)
+    rows = XModuleUserStateSummaryField.objects.filter(
+        usage_id__in=[UsageKey.from_string(usage_id) for usage_id in usage_ids],
+        field_name__in=SUMMARY_FIELDS,
+    ).values_list('usage_id', 'field_name', 'value')
+    for usage_id, field_name, value in rows:
+        fields[u"{}".format(usage_id)][field_name] = json.loads(value)
+    return fields
+
+
+def block_aggregates(block, fields, counters=None):
+    """
+    Args:
+        block (dict): as yielded by `iter_course_blocks`
+        fields (dict): as returned by `load_summary_fields`
+        counters (AggregateCounters): pending increments are added when
+        provided.
+    Returns:
+        record (dict)
+    """
+    record = dict(block)
+    for name in SUMMARY_COUNTERS:
+        record[name] = fields.get(name, 0)
+    controls = decode_controls(fields.get('most_used_controls', "0"))
+    if counters is not None:
+        pending = counters.pending(block['usage_id'], get_counter_names(), fields.get('counters_cursors', {}))
+        for name in SUMMARY_COUNTERS:
+            record[name] += pending[name]
+        for index in range(len(CONTROLS)):
+            controls[index] += pending[control_counter_name(index)]
+    record['avg_watch_time'] = record['total_watch_time'] / record['total_views'] if record['total_views'] else 0
+    record['controls'] = dict(zip(CONTROLS, controls))
+    if fields.get('timeline_heatmap'):
+        heatmap = json.loads(fields['timeline_heatmap'])
+    else:
+        heatmap = timeline_encoding.make_heatmap(timeline_encoding.decode(fields.get('total_timeline', "")))
+    record['heatmap'] = heatmap
+    return record
+
+
+def iter_aggregates(blocks, load_fields=load_summary_fields, counters=None, workers=8, batch_size=64):
+    """
+    Compute the aggregates of blocks in parallel, in bounded batches. Each
+    batch is split in one chunk per worker, whose summary fields are loaded
+    with a single query.
+
+    Args:
+        load_fields (callable): takes a list of usage ids, and returns their
+        summary fields like `load_summary_fields`.
+    Yields:
+        record (dict): as returned by `block_aggregates`, in the order of
+        `blocks`.
+    """
+    def process(chunk):
+        try:
+            fields = load_fields([block['usage_id'] for block in chunk])
+            return [block_aggregates(block, fields[block['usage_id']], counters=counters) for block in chunk]
+        finally:
+            close_db_connection()
+
+    pool = ThreadPool(workers)
+    try:
+        blocks = iter(blocks)
+        while True:
+            batch = list(islice(blocks, batch_size))
+            if not batch:
+                break
+            chunk_size = (len(batch) + workers - 1) // workers
+            chunks = [batch[start:start + chunk_size] for start in range(0, len(batch), chunk_size)]
+            for records in pool.map(process, chunks):
+                for record in records:
+                    yield record
+    finally:
+        pool.close()
+        pool.join()
+
+
+def close_db_connection():
+    """
+    Database connections are per-thread: close them once a worker thread is
+    done with a chunk, such that they are not left open by idle threads.
+    """
+    try:
+        from django.db import connection
+    except ImportError:
+        return
+    connection.close()
+
+
+def write_jsonl(records, output):
+    for record in records:
+        output.write(json.dumps(record, sort_keys=True))
+        output.write("\n")
+
+
+def write_csv(records, output):
+    writer = csv.writer(output)
+    writer.writerow(CSV_COLUMNS)
+    for record in records:
+        row = [record[column] for column in CSV_COLUMNS[:3 + len(SUMMARY_COUNTERS) + 1]]
+        row += [record['controls'][control] for control in CONTROLS]
+        row.append(" ".join(str(count) for count in record['heatmap']['bins']))
+        writer.writerow(row)
+
+
+WRITERS = {
+    'jsonl': write_jsonl,
+    'csv': write_csv,
+}
+
+
+def export_course(course_id, output, output_format='jsonl', workers=8):
+    """
+    Stream the aggregates of all the Videofront XBlocks of a course to
+    `output`.
+    """
+    from django.conf import settings
+    from opaque_keys.edx.keys import CourseKey # pylint: disable=import-error
+
+    course_key = CourseKey.from_string(course_id)
+    block_settings = getattr(settings, 'XBLOCK_SETTINGS', {}).get(BLOCK_TYPE, {})
+    records = iter_aggregates(
+        iter_course_blocks(course_key),
+        counters=get_counters(block_settings),
+        workers=workers,
+    )
+    WRITERS[output_format](records, output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the analytics of the Videofront XBlocks of a course")
+    parser.add_argument('course_id')
+    parser.add_argument('--format', choices=sorted(WRITERS), default='jsonl')
+    parser.add_argument('--output', help="Output file (default: stdout)")
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    import django
+    django.setup()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            export_course(args.course_id, output, output_format=args.format, workers=args.workers)
+    else:
+        export_course(args.course_id, sys.stdout, output_format=args.format, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+Timing instrumentation of the hot paths of the XBlock.
+
+Measurements are sampled, then published through a sink:
+
+* 'logging': one log record per measurement;
+* 'statsd': one UDP datagram per measurement, in the statsd format (tags
+  use the DogStatsD extension);
+* 'prometheus': measurements are aggregated in memory and periodically
+  written to a file in the Prometheus text format, e.g. for the textfile
+  collector of the node exporter.
+"""
+import functools
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LoggingSink(object):
+
+    def __init__(self, prefix, level=logging.INFO):
+        self.prefix = prefix
+        self.level = level
+
+    def timing(self, name, milliseconds, tags, rate):
+        logger.log(self.level, "%s.%s %.3fms %s", self.prefix, name, milliseconds, format_tags(tags))
+
+    def incr(self, name, tags, rate):
+        logger.log(self.level, "%s.%s +1 %s", self.prefix, name, format_tags(tags))
+
+
+class StatsdSink(object):
+
+    def __init__(self, prefix, host='127.0.0.1', port=8125):
+        self.prefix = prefix
+        self.address = (host, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, name, value, metric_type, tags, rate):
+        line = '{}.{}:{}|{}'.format(self.prefix, name, value, metric_type)
+        if rate < 1:
+            line += '|@{}'.format(rate)
+        if tags:
+            line += '|#' + ','.join('{}:{}'.format(key, tags[key]) for key in sorted(tags))
+        try:
+            self.socket.sendto(line.encode('utf8'), self.address)
+        except socket.error:
+            # Metrics must never break the platform
+            pass
+
+    def timing(self, name, milliseconds, tags, rate):
+        self.send(name, round(milliseconds, 3), 'ms', tags, rate)
+
+    def incr(self, name, tags, rate):
+        self.send(name, 1, 'c', tags, rate)
+
+
+class PrometheusSink(object):
+    """
+    Aggregate measurements as Prometheus summaries (durations) and counters.
+    Sampled measurements are scaled by the inverse of the sample rate.
+
+    Each process writes its own file: "{pid}" in `path` is replaced by the
+    process id, which is otherwise inserted before the file extension.
+    Series are labelled with the process id too, such that the files of all
+    the workers can be collected together.
+    """
+
+    def __init__(self, prefix, path=None, dump_interval=60):
+        self.prefix = prefix.replace('.', '_').replace('-', '_')
+        self.path = path
+        self.dump_interval = dump_interval
+        self.summaries = {}
+        self.counters = {}
+        self.dumped_at = time.time()
+        self._lock = threading.Lock()
+
+    def timing(self, name, milliseconds, tags, rate):
+        key = (name, tuple(sorted(tags.items())))
+        with self._lock:
+            count, total = self.summaries.get(key, (0, 0))
+            self.summaries[key] = (count + 1. / rate, total + milliseconds / 1000. / rate)
+        self.maybe_dump()
+
+    def incr(self, name, tags, rate):
+        key = (name, tuple(sorted(tags.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1. / rate
+        self.maybe_dump()
+
+    def get_path(self):
+        """
+        Returns:
+            path (str): file of the current process. It is computed on every
+            dump, since sinks may be created before workers are forked.
+        """
+        pid = str(os.getpid())
+        if '{pid}' in self.path:
+            return self.path.replace('{pid}', pid)
+        root, extension = os.path.splitext(self.path)
+        return '{}.{}{}'.format(root, pid, extension)
+
+    def render(self):
+        """
+        Returns:
+            text (str): all metrics, in the Prometheus text exposition format.
+        """
+        lines = []
+        pid = ('pid', str(os.getpid()))
+        with self._lock:
+            summaries = sorted(((name, labels + (pid,)), value) for (name, labels), value in self.summaries.items())
+            counters = sorted(((name, labels + (pid,)), value) for (name, labels), value in self.counters.items())
+        typed = set()
+        for (name, labels), (count, total) in summaries:
+            metric = '{}_{}_seconds'.format(self.prefix, name.replace('.', '_'))
+            if metric not in typed:
+                typed.add(metric)
+                lines.append('# TYPE {} summary'.format(metric))
+            lines.append('{}_count{} {}'.format(metric, format_labels(labels), count))
+            lines.append('{}_sum{} {}'.format(metric, format_labels(labels), total))
+        for (name, labels), count in counters:
+            metric = '{}_{}_total'.format(self.prefix, name.replace('.', '_'))
+            if metric not in typed:
+                typed.add(metric)
+                lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{}{} {}'.format(metric, format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def maybe_dump(self):
+        if not self.path or time.time() - self.dumped_at < self.dump_interval:
+            return
+        self.dumped_at = time.time()
+        self.dump()
+
+    def dump(self):
+        """Atomically write all metrics to the file of the current process."""
+        path = self.get_path()
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(self.render())
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            logger.warning("Could not write Videofront metrics to %s: %s", path, e)
+
+
+def format_tags(tags):
+    return ' '.join('{}={}'.format(key, tags[key]) for key in sorted(tags))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, value) for key, value in labels) + '}'
+
+
+class Timer(object):
+    """
+    Context manager that publishes its duration. Tags can be added until it
+    exits, e.g. to record the outcome of the timed operation.
+    """
+
+    def __init__(self, metrics, name, tags):
+        self.metrics = metrics
+        self.name = name
+        self.tags = tags
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        milliseconds = (time.time() - self.start) * 1000
+        self.metrics.sink.timing(self.name, milliseconds, self.tags, self.metrics.sample_rate)
+
+
+class NullTimer(object):
+    """Timer of measurements that are not sampled."""
+
+    def __init__(self):
+        self.tags = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class Metrics(object):
+    """
+    Sampled measurements. Without sink, measurements are disabled and cost
+    a single attribute lookup.
+    """
+
+    def __init__(self, sink=None, sample_rate=1):
+        self.sink = sink
+        self.sample_rate = sample_rate
+
+    def sampled(self):
+        return self.sink is not None and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+
+    def timer(self, name, **tags):
+        if not self.sampled():
+            return NullTimer()
+        return Timer(self, name, tags)
+
+    def incr(self, name, **tags):
+        if self.sampled():
+            self.sink.incr(name, tags, self.sample_rate)
+
+
+def timed_handler(handler):
+    """
+    Decorator that times an XBlock handler. It must be applied on top of the
+    `XBlock.handler` or `XBlock.json_handler` decorators, such that the
+    decoding and encoding of requests are timed too.
+    """
+    @functools.wraps(handler)
+    def wrapper(self, *args, **kwargs):
+        with self.get_metrics().timer('handler', handler=handler.__name__):
+            return handler(self, *args, **kwargs)
+    return wrapper
+
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def get_metrics(settings):
+    """
+    Return the metrics configured in the settings bucket.
+
+    Relevant settings:
+        METRICS_SINK: None (default), 'logging', 'statsd' or 'prometheus'
+        METRICS_SAMPLE_RATE: fraction of the measurements that are published
+        METRICS_PREFIX: prefix of the metric names
+        STATSD_HOST, STATSD_PORT: address of the statsd server
+        PROMETHEUS_FILE: file where the 'prometheus' metrics are written, see
+        `PrometheusSink`
+        PROMETHEUS_DUMP_INTERVAL: time (in seconds) between two writes
+    """
+    sink_name = settings.get('METRICS_SINK')
+    config = (
+        sink_name,
+        settings.get('METRICS_SAMPLE_RATE', 0.1),
+        settings.get('METRICS_PREFIX', 'videofront_xblock'),
+        settings.get('STATSD_HOST', '127.0.0.1'),
+        settings.get('STATSD_PORT', 8125),
+        settings.get('PROMETHEUS_FILE'),
+        settings.get('PROMETHEUS_DUMP_INTERVAL', 60),
+    )
+    metrics = _metrics.get(config)
+    if metrics is not None:
+        return metrics
+    with _metrics_lock:
+        metrics = _metrics.get(config)
+        if metrics is None:
+            if not sink_name:
+                sink = None
+            elif sink_name == 'logging':
+                sink = LoggingSink(config[2])
+            elif sink_name == 'statsd':
+                sink = StatsdSink(config[2], host=config[3], port=config[4])
+            elif sink_name == 'prometheus':
+                sink = PrometheusSink(config[2], path=config[5], dump_interval=config[6])
+            else:
+                raise ValueError("Unknown Videofront metrics sink: {}".format(sink_name))
+            metrics = _metrics[config] = Metrics(sink, sample_rate=config[1])
+    return metrics
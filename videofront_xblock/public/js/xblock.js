@@ -2,7 +2,6 @@ function VideofrontXBlock(runtime, element, args) {
     $(window).resize(function () {
       $('#tscript').height($('#video-cont').outerHeight(true));
     });
-    avg_watch_time = args.avg_watch_time;
     console.log("videojs:", videojs);
 
     // Create player function
@@ -40,6 +39,11 @@ function VideofrontXBlock(runtime, element, args) {
       sendControlsAnalytics("0,0,0,0,0,1,0,0,0,0,0");
     });
     player.one('loadedmetadata', function() {
+      // Resume playback where the user left it, unless the video was over
+      if (args.resume_position > 0 && args.resume_position < player.duration() - 5) {
+        player.currentTime(args.resume_position);
+      }
+
       var tracks = player.textTracks();
 
       // Change track
@@ -60,69 +64,122 @@ function VideofrontXBlock(runtime, element, args) {
 
         sendControlsAnalytics("0,0,0,0,1,0,0,0,0,0,0");
       });
-
-      // Highlight current cue
-      for (var t = 0; t < tracks.length; t++) {
-        tracks[t].addEventListener('cuechange', oncuechange);
-      }
     });
 
+    // Transcripts are loaded from the `transcript` handler as cue indexes:
+    // `starts`, `ends` and `texts` arrays, sorted by start time.
+    var transcripts = {};
+    var transcript = null;
+    var transcriptCueElements = [];
+    var activeCue = -1;
+
     var showTranscript = function(track) {
       if (!show_transcript)
         return;
-      var cues = track.cues;
 
       // We need to check whether the track is still the one currently showing.
       if (track.mode !== "showing") {
         return;
       }
 
-      // Cues may not be loaded yet. If not, wait until they are. This is
-      // suboptimal, but there is no other event to help us determine whether a
-      // track was correctly loaded.
-      if (!cues || cues.length === 0) {
-        window.setTimeout(function() { showTranscript(track); }, 2);
+      var language = track.language;
+      if (transcripts[language]) {
+        renderTranscript(transcripts[language]);
+        return;
       }
+      $.ajax({
+        type: "GET",
+        url: runtime.handlerUrl(element, 'transcript', language),
+        dataType: "json",
+        success: function(data) {
+          transcripts[language] = data;
+          if (show_transcript && track.mode === "showing") {
+            renderTranscript(data);
+          }
+        }
+      });
+    };
 
-      var htmlContent = "";
-      for (var c = 0; c < cues.length; c++) {
-        var cue = cues[c];
-        htmlContent += "<span class='cue' begin='" + cue.startTime + "'>&nbsp;-&nbsp;" + cue.text + "</span><br/>\n";
+    var renderTranscript = function(index) {
+      transcript = index;
+      activeCue = -1;
+      transcriptCueElements = [];
+      var cues = document.createDocumentFragment();
+      for (var c = 0; c < index.starts.length; c++) {
+        var cueElement = document.createElement("span");
+        cueElement.className = "cue";
+        cueElement.setAttribute("data-cue", c);
+        cueElement.textContent = "\u00a0-\u00a0" + index.texts[c];
+        cues.appendChild(cueElement);
+        cues.appendChild(document.createElement("br"));
+        transcriptCueElements.push(cueElement);
       }
 
       videoPlayerElement.addClass("transcript-enabled");
       $('#tscript').height($('#video-cont').outerHeight(true));
-      transcriptElement.html(htmlContent);
-
-      // Go to time on cue click
-      transcriptElement.find(".cue").click(function() {
-          player.currentTime($(this).attr('begin'));
-      });
+      transcriptElement.empty();
+      transcriptElement[0].appendChild(cues);
+      highlightCue(player.currentTime());
     };
 
     var disableTranscript = function() {
+      transcript = null;
       videoPlayerElement.removeClass("transcript-enabled");
       $('#tscript').height($('#video-cont').outerHeight(true));
     };
 
-    var oncuechange = function() {
-      if (!show_transcript)
-        return;
-      transcriptElement.find(".current.cue").removeClass("current");
-      var cueElement;
-      for (var c = 0; c < this.activeCues.length; c++) {
-        cueElement = transcriptElement.find(".cue[begin='" + this.activeCues[c].startTime + "']");
-        cueElement.addClass("current");
+    // Go to time on cue click
+    transcriptElement.on('click', '.cue', function() {
+      if (transcript) {
+        player.currentTime(transcript.starts[$(this).attr('data-cue')]);
       }
-      if (cueElement) {
-        // Scroll to cue
-        var newtop = transcriptElement.scrollTop() - transcriptElement.offset().top + cueElement.offset().top;
-        transcriptElement.animate({
-            scrollTop: newtop
-        }, 500);
+    });
+
+    // Index of the cue that is active at `time`, or -1
+    var findCue = function(time) {
+      var starts = transcript.starts;
+      var low = 0;
+      var high = starts.length - 1;
+      var found = -1;
+      while (low <= high) {
+        var middle = (low + high) >> 1;
+        if (starts[middle] <= time) {
+          found = middle;
+          low = middle + 1;
+        } else {
+          high = middle - 1;
+        }
       }
+      if (found >= 0 && time >= transcript.ends[found]) {
+        return -1;
+      }
+      return found;
     };
 
+    // Highlight current cue
+    var highlightCue = function(time) {
+      if (!show_transcript || !transcript)
+        return;
+      var cue = findCue(time);
+      if (cue === activeCue)
+        return;
+      if (activeCue >= 0) {
+        $(transcriptCueElements[activeCue]).removeClass("current");
+      }
+      activeCue = cue;
+      if (cue < 0)
+        return;
+      var cueElement = $(transcriptCueElements[cue]).addClass("current");
+      // Scroll to cue
+      var newtop = transcriptElement.scrollTop() - transcriptElement.offset().top + cueElement.offset().top;
+      transcriptElement.stop().animate({
+          scrollTop: newtop
+      }, 500);
+    };
+    player.on('timeupdate', function() {
+      highlightCue(player.currentTime());
+    });
+
     // Restore height of transcript div after exiting full screen
     player.on('fullscreenchange', function() {
       $('#tscript').height($('#video-cont').outerHeight(true));
@@ -157,10 +214,200 @@ function VideofrontXBlock(runtime, element, args) {
       back: 10
     });
 
-    player.vttThumbnails({
-      src: args.poster_frames
+    // Adaptive quality: the renditions of the video are loaded from the
+    // `manifest` handler and the bandwidth is probed by downloading the
+    // beginning of the lowest rendition. The player then starts with the best
+    // rendition that the bandwidth can sustain, and steps down when playback
+    // stalls repeatedly. Picking a resolution manually disables this.
+    var ABR_PROBE_BYTES = 256 * 1024;
+    var ABR_PROBE_TIMEOUT = 5000;
+    // Fraction of the measured bandwidth that a rendition may use
+    var ABR_SAFETY_FACTOR = 0.7;
+    // Step down after this many stalls within the window (in milliseconds)
+    var ABR_STALLS = 2;
+    var ABR_STALLS_WINDOW = 30000;
+    var renditions = [];
+    var autoQuality = args.adaptive;
+    var abrSwitching = false;
+    var stalls = [];
+
+    var probeBandwidth = function(url, callback) {
+      var request = new XMLHttpRequest();
+      var start = Date.now();
+      request.open('GET', url);
+      request.setRequestHeader('Range', 'bytes=0-' + (ABR_PROBE_BYTES - 1));
+      request.responseType = 'arraybuffer';
+      request.timeout = ABR_PROBE_TIMEOUT;
+      request.onload = function() {
+        var seconds = (Date.now() - start) / 1000;
+        var bytes = request.response ? request.response.byteLength : 0;
+        // Bandwidth in kbit/s
+        callback(bytes > 0 && seconds > 0 ? bytes * 8 / 1000 / seconds : null);
+      };
+      request.onerror = request.ontimeout = function() { callback(null); };
+      request.send();
+    };
+
+    // Best rendition whose bitrate fits in the bandwidth, or the lowest one
+    var pickRendition = function(bandwidth) {
+      var picked = renditions[0];
+      for (var r = 0; r < renditions.length; r++) {
+        if (renditions[r].res && renditions[r].res <= bandwidth * ABR_SAFETY_FACTOR) {
+          picked = renditions[r];
+        }
+      }
+      return picked;
+    };
+
+    var switchRendition = function(rendition) {
+      if (!rendition || rendition.label === player.currentResolution().label) {
+        return;
+      }
+      abrSwitching = true;
+      if (!player.currentResolution(rendition.label)) {
+        abrSwitching = false;
+      }
+    };
+
+    // Whether the player already has the sources of the renditions, e.g.
+    // because they were rendered server-side
+    var hasSources = function(sources) {
+      var current = player.currentSources().map(function(source) { return source.src; }).sort();
+      var expected = sources.map(function(source) { return source.src; }).sort();
+      return current.join("\n") === expected.join("\n");
+    };
+
+    var loadManifest = function(data) {
+      renditions = data.renditions;
+      if (renditions.length === 0) {
+        return;
+      }
+      if (!hasSources(renditions)) {
+        // Do not reset the source of a player that already plays it
+        abrSwitching = true;
+        player.updateSrc(renditions);
+        abrSwitching = false;
+      }
+      if (renditions.length < 2 || !renditions[0].res) {
+        return;
+      }
+      // Videos are not preloaded: do not download anything before playback
+      // starts either.
+      var probe = function() {
+        probeBandwidth(renditions[0].src, function(bandwidth) {
+          if (autoQuality && bandwidth !== null) {
+            switchRendition(pickRendition(bandwidth));
+          }
+        });
+      };
+      if (player.hasStarted()) {
+        probe();
+      } else {
+        player.one('play', probe);
+      }
+    };
+
+    player.on('resolutionchange', function() {
+      if (!abrSwitching) {
+        autoQuality = false;
+      }
+      abrSwitching = false;
+    });
+
+    player.on('waiting', function() {
+      if (!autoQuality || player.seeking() || player.currentTime() === 0) {
+        return;
+      }
+      var now = Date.now();
+      stalls.push(now);
+      stalls = stalls.filter(function(time) { return now - time < ABR_STALLS_WINDOW; });
+      if (stalls.length < ABR_STALLS) {
+        return;
+      }
+      stalls = [];
+      var label = player.currentResolution().label;
+      for (var r = 1; r < renditions.length; r++) {
+        if (renditions[r].label === label) {
+          switchRendition(renditions[r - 1]);
+        }
+      }
     });
 
+    if (args.adaptive) {
+      $.ajax({
+        type: "GET",
+        url: runtime.handlerUrl(element, 'manifest'),
+        dataType: "json",
+        success: loadManifest
+      });
+    }
+
+    if (args.deferred) {
+      // Video metadata were not rendered server-side: fetch them now
+      $.ajax({
+        type: "GET",
+        url: runtime.handlerUrl(element, 'video_metadata'),
+        dataType: "json",
+        success: loadVideoMetadata
+      });
+    } else {
+      player.vttThumbnails({
+        src: args.poster_frames
+      });
+    }
+
+    function loadVideoMetadata(data) {
+      var messages = $('.messages', element).empty();
+      $.each(data.messages, function(i, message) {
+        $('<p>').addClass(message[0]).append(
+          $('<i>').addClass("icon fa fa-" + message[0]),
+          $('<span>').text(message[1])
+        ).appendTo(messages);
+      });
+
+      if (data.thumbnail) {
+        player.poster(data.thumbnail);
+      }
+      // Unless the adaptive quality picker already set them
+      if (renditions.length === 0 && data.sources.length > 0) {
+        player.updateSrc(data.sources);
+      }
+      $.each(data.subtitles, function(i, subtitle) {
+        player.addRemoteTextTrack({
+          kind: 'subtitles',
+          src: subtitle.src,
+          srclang: subtitle.srclang,
+          label: subtitle.label
+        }, false);
+      });
+      if (data.poster_frames) {
+        player.vttThumbnails({
+          src: data.poster_frames
+        });
+      }
+
+      var downloads = $('.downloads', element).empty();
+      appendDownloads(downloads, "Download video: ", "video_download", data.video_downloads, 'label');
+      appendDownloads(downloads, "Download Transcript: ", "transcript_download", data.transcript_downloads, 'language');
+    }
+
+    function appendDownloads(container, title, id, downloads, labelKey) {
+      if (downloads.length === 0) {
+        return;
+      }
+      var links = $('<div style="padding: 0 0 0 1em; width:10em; height: 4em; float:left;">');
+      $.each(downloads, function(i, download) {
+        if (i > 0) {
+          links.append('<br>');
+        }
+        $('<a target="_blank">').attr({href: download.url, id: id}).text(download[labelKey]).appendTo(links);
+      });
+      $('<div style="width: auto; height: auto; float: left; margin: 1em;">').append(
+        $('<p style="float: left; display: block;">').text(title),
+        links
+      ).appendTo(container);
+    }
+
     // Implement Star Rating
     var handlerUrl = runtime.handlerUrl(element, 'like_dislike');
     function updateLikeDislike(data) {
@@ -259,17 +506,32 @@ function VideofrontXBlock(runtime, element, args) {
       });
       sendControlsAnalytics("0,0,0,0,0,0,0,1,0,0,0");
     });
+    // Analytics are computed on demand, when the panel is opened
+    var analyticsHandlerUrl = runtime.handlerUrl(element, 'analytics');
+    function showAnalytics(data) {
+      if (data.error) {
+        $('.analytics-content', element).text(data.error);
+        return;
+      }
+      $('.analytics-content', element).html(data.html);
+      $('#avg_watch_time').text(secondsToString(data.avg_watch_time));
+      if (analyticsEndTime !== null)
+        $('#end_time').text(analyticsEndTime);
+      if (watchTimeMessage !== null)
+        $('#watch_time_msg').text(watchTimeMessage);
+    }
     $('.analytics_btn', element).click(function(eventObject) {
       $('#analytics_cont').css('display','flex');
+      $.ajax({
+        type: "POST",
+        url: analyticsHandlerUrl,
+        data: JSON.stringify({}),
+        success: showAnalytics
+      });
     });
   
     // Analytics Server Urls
     getTimelineHandlerUrl = runtime.handlerUrl(element, 'getTimeline');
-    saveTimelineHandlerUrl = runtime.handlerUrl(element, 'saveTimeline');
-    saveTotalWatchTimeHandlerUrl = runtime.handlerUrl(element, 'saveTotalWatchTime');
-    saveMostUsedControlsHandlerUrl = runtime.handlerUrl(element, 'saveMostUsedControls');
-    saveTranscriptDownloadedHandlerUrl = runtime.handlerUrl(element, 'saveTranscriptDownloaded');
-    saveVideoDownloadedHandlerUrl = runtime.handlerUrl(element, 'saveVideoDownloaded');
+    ingestEventsHandlerUrl = runtime.handlerUrl(element, 'ingest_events');
 
-    $('#avg_watch_time').text(secondsToString(avg_watch_time));
 }
\ No newline at end of file
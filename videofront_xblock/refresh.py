@@ -0,0 +1,94 @@
+"""
+Background refresh of video metadata.
+
+While a video is being processed, its metadata change until processing is
+over. Instead of fetching them on page views, a scheduler thread polls the
+API with exponential backoff and keeps the metadata cache up to date.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshScheduler(object):
+    """
+    Run refresh jobs in a single background thread. A job is a callable that
+    returns True as long as it must be called again. The delay between two
+    calls doubles every time, up to `max_delay`, and jobs are dropped after
+    `timeout` seconds.
+    """
+
+    def __init__(self, name='videofront-xblock-refresh'):
+        self.name = name
+        self._queue = []
+        self._jobs = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, key, job, delay, max_delay, timeout):
+        """
+        Schedule a job, unless a job with the same key is scheduled sooner.
+
+        Args:
+            key (str): identifier of the job
+            job (callable)
+            delay (float): time (in seconds) before the first call
+        """
+        now = time.time()
+        with self._condition:
+            scheduled = self._jobs.get(key)
+            if scheduled is not None and scheduled['due'] <= now + delay:
+                return
+            if scheduled is None:
+                scheduled = self._jobs[key] = {
+                    'job': job,
+                    'delay': delay,
+                    'max_delay': max_delay,
+                    'deadline': now + timeout,
+                }
+            scheduled['due'] = now + delay
+            heapq.heappush(self._queue, (scheduled['due'], next(self._sequence), key))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+    def is_scheduled(self, key):
+        return key in self._jobs
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._queue or self._queue[0][0] > time.time():
+                    self._condition.wait(self._queue[0][0] - time.time() if self._queue else None)
+                due, _sequence, key = heapq.heappop(self._queue)
+                scheduled = self._jobs.get(key)
+                if scheduled is None or scheduled['due'] != due:
+                    # The job was rescheduled sooner
+                    continue
+            try:
+                again = scheduled['job']()
+            except Exception: # pylint: disable=broad-except
+                logger.exception("Videofront refresh job %s failed", key)
+                again = True
+            with self._condition:
+                scheduled['delay'] = min(max(scheduled['delay'] * 2, 1), scheduled['max_delay'])
+                if again and time.time() + scheduled['delay'] < scheduled['deadline']:
+                    scheduled['due'] = time.time() + scheduled['delay']
+                    heapq.heappush(self._queue, (scheduled['due'], next(self._sequence), key))
+                else:
+                    del self._jobs[key]
+
+
+_scheduler = RefreshScheduler()
+
+
+def get_scheduler():
+    """Scheduler of the current process."""
+    return _scheduler
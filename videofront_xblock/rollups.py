@@ -0,0 +1,93 @@
+"""
+Time-bucketed analytics rollups.
+
+Counts of each metric are kept per period (hour or day) in a ring buffer
+with a fixed number of slots, such that storage is bounded and an update
+only touches the slot of the current period. Each slot is a row of the
+period number followed by the count of each metric; the slot of a period is
+reused, and reset, when a later period maps to it. Rows are stored like
+timelines, as compressed arrays of unsigned 32-bit integers.
+"""
+from array import array
+import time
+
+from . import timeline as timeline_encoding
+
+PERIODS = {
+    'hourly': 3600,
+    'daily': 24 * 3600,
+}
+METRICS = ('views', 'watch_time', 'controls', 'video_downloads', 'transcript_downloads')
+# Header: period duration in seconds, number of slots
+HEADER_SIZE = 2
+ROW_SIZE = 1 + len(METRICS)
+
+
+class Rollups(object):
+
+    def __init__(self, period, size, values=None):
+        """
+        Args:
+            period (int): duration of a period, in seconds
+            size (int): number of periods that are kept
+        """
+        self.period = period
+        self.size = size
+        if values is None:
+            values = array(timeline_encoding.TYPECODE, [period, size]) + \
+                array(timeline_encoding.TYPECODE, [0]) * (size * ROW_SIZE)
+        self.values = values
+
+    @classmethod
+    def decode(cls, value, period, size):
+        """
+        Returns:
+            rollups (Rollups): empty if `value` is empty or was encoded with a
+            different period or size.
+        """
+        values = timeline_encoding.decode(value) if value else None
+        if values is None or list(values[:HEADER_SIZE]) != [period, size] or \
+                len(values) != HEADER_SIZE + size * ROW_SIZE:
+            values = None
+        return cls(period, size, values)
+
+    def encode(self):
+        return timeline_encoding.encode(self.values)
+
+    def period_at(self, timestamp=None):
+        """Number of the period of a timestamp (default: now)."""
+        return int((time.time() if timestamp is None else timestamp) // self.period)
+
+    def add(self, period_number, metric, delta):
+        """
+        Add `delta` to the count of `metric` in a period. Deltas of periods
+        that are too old to be kept are ignored.
+        """
+        offset = HEADER_SIZE + (period_number % self.size) * ROW_SIZE
+        slot_period = self.values[offset]
+        if slot_period > period_number:
+            return
+        if slot_period < period_number:
+            self.values[offset] = period_number
+            for index in range(1, ROW_SIZE):
+                self.values[offset + index] = 0
+        self.values[offset + 1 + METRICS.index(metric)] += delta
+
+    def get(self, period_number, metric):
+        offset = HEADER_SIZE + (period_number % self.size) * ROW_SIZE
+        if self.values[offset] != period_number:
+            return 0
+        return self.values[offset + 1 + METRICS.index(metric)]
+
+    def series(self, metric, last_period=None):
+        """
+        Returns:
+            series (list): `(period start timestamp, count)` tuples of the
+            `size` periods that end with `last_period` (default: the current
+            period), oldest first.
+        """
+        last_period = self.period_at() if last_period is None else last_period
+        return [
+            (period_number * self.period, self.get(period_number, metric))
+            for period_number in range(last_period - self.size + 1, last_period + 1)
+        ]
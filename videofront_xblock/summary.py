@@ -0,0 +1,42 @@
+"""
+Aggregates that are shared by all the learners of a block, and stored in its
+`Scope.user_state_summary` fields. Used by the XBlock and by the analytics
+export.
+"""
+
+# Summary fields that are counters
+COUNTERS = (
+    'like_count', 'dislike_count', 'vid_rep_cnt', 'aud_rep_cnt', 'total_views',
+    'total_watch_time', 'video_downloads', 'transcript_downloads',
+)
+# Controls whose usage is counted in `most_used_controls`, by index
+CONTROLS = (
+    'Play/Pause', 'Volume Change', 'Playback Rate Change', 'Seeking', 'Subtitles Toggle',
+    'Transcript Toggle', 'Like/Dislike', 'Report', 'Picture in Picture', 'Video Download',
+    'Transcript Download',
+)
+
+
+def control_counter_name(index):
+    """Name of the aggregate counter of the usage of a control."""
+    return 'most_used_controls.{}'.format(index)
+
+
+def get_counter_names():
+    """
+    Returns:
+        names (tuple): aggregate counters of the summary counters and of the
+        usage of each control.
+    """
+    return COUNTERS + tuple(control_counter_name(index) for index in range(len(CONTROLS)))
+
+
+def decode_controls(value):
+    """
+    Args:
+        value (str): comma-separated counts, as stored in `most_used_controls`
+    Returns:
+        counts (list): usage count of each control.
+    """
+    counts = [int(count) for count in value.split(",")]
+    return counts + [0] * (len(CONTROLS) - len(counts))
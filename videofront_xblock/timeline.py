@@ -0,0 +1,297 @@
+"""
+Compact storage of per-second watch counts.
+
+Timelines used to be stored as comma-separated strings, which are slow to
+parse and large for long videos. They are now stored as zlib-compressed
+arrays of little-endian unsigned 32-bit integers, encoded in base64 and
+prefixed with `ENCODED_PREFIX`. Legacy comma-separated values are still
+decoded transparently, and are converted the next time they are written.
+
+Browsers send the seconds that were watched since their previous request as
+ranges, such that payloads and updates are proportional to the new activity
+instead of the video length. The seconds watched by each user are stored as
+a union of ranges.
+
+The heatmap displayed in the analytics panel is a downsampled version of the
+total timeline. It is stored separately and updated incrementally on every
+save, such that rendering it does not depend on the video length.
+"""
+from array import array
+import base64
+import sys
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ENCODED_PREFIX = 'z:'
+# Timelines are small: favour speed over compression ratio
+COMPRESSION_LEVEL = 1
+
+# Bounds on the number of bars of the heatmap
+MIN_BARS = 60
+MAX_BARS = 240
+
+# Upper bound on the seconds sent by browsers (24 hours)
+MAX_SECONDS = 24 * 3600
+
+# Typecode of unsigned 32-bit integers on this platform
+TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+
+
+def _frombytes(values, data):
+    getattr(values, 'frombytes', getattr(values, 'fromstring', None))(data)
+
+
+def _tobytes(values):
+    return getattr(values, 'tobytes', getattr(values, 'tostring', None))()
+
+
+def decode(value):
+    """
+    Args:
+        value (str): encoded timeline, or legacy comma-separated string.
+    Returns:
+        timeline (array): watch count for each second of the video.
+    """
+    timeline = array(TYPECODE)
+    if not value:
+        return timeline
+    if value.startswith(ENCODED_PREFIX):
+        _frombytes(timeline, zlib.decompress(base64.b64decode(value[len(ENCODED_PREFIX):])))
+        if sys.byteorder == 'big':
+            timeline.byteswap()
+    else:
+        timeline.extend(int(x) for x in value.split(","))
+    return timeline
+
+
+def encode(timeline):
+    """
+    Args:
+        timeline (array): as returned by `decode`
+    Returns:
+        value (str)
+    """
+    if sys.byteorder == 'big':
+        timeline = array(TYPECODE, timeline)
+        timeline.byteswap()
+    data = base64.b64encode(zlib.compress(_tobytes(timeline), COMPRESSION_LEVEL))
+    return ENCODED_PREFIX + data.decode('ascii')
+
+
+def parse_csv(value):
+    """Parse a comma-separated timeline, as sent by the browser."""
+    return array(TYPECODE, [int(x) for x in value.split(",")]) if value else array(TYPECODE)
+
+
+def merge(total_timeline, old_timeline, new_timeline):
+    """
+    Add to `total_timeline` the counts of the seconds for which the watch
+    count of a user increased from `old_timeline` to `new_timeline`.
+
+    All arrays are padded with zeros to the length of `new_timeline`. The
+    element-wise merge is vectorized with numpy, when it is installed.
+
+    Returns:
+        total_timeline (array): new array
+        increments (list): `(second, count)` tuples of the counts that were
+        added to the total timeline.
+    """
+    size = len(new_timeline)
+    if numpy is not None:
+        return _merge_numpy(total_timeline, old_timeline, new_timeline, size)
+    if len(old_timeline) < size:
+        old_timeline = old_timeline + array(TYPECODE, [0]) * (size - len(old_timeline))
+    if len(total_timeline) < size:
+        total_timeline = total_timeline + array(TYPECODE, [0]) * (size - len(total_timeline))
+    increments = [
+        (second, new)
+        for second, (old, new) in enumerate(zip(old_timeline, new_timeline))
+        if old < new
+    ]
+    merged = array(TYPECODE, total_timeline)
+    for second, count in increments:
+        merged[second] += count
+    return merged, increments
+
+
+def _merge_numpy(total_timeline, old_timeline, new_timeline, size):
+    dtype = numpy.uint32
+    new = numpy.frombuffer(new_timeline, dtype=dtype) if size else numpy.zeros(0, dtype=dtype)
+    old = numpy.zeros(size, dtype=dtype)
+    old_size = min(size, len(old_timeline))
+    if old_size:
+        old[:old_size] = numpy.frombuffer(old_timeline, dtype=dtype)[:old_size]
+    total = numpy.zeros(max(size, len(total_timeline)), dtype=dtype)
+    if len(total_timeline):
+        total[:len(total_timeline)] = numpy.frombuffer(total_timeline, dtype=dtype)
+    seconds = numpy.nonzero(new > old)[0]
+    counts = new[seconds]
+    total[seconds] += counts
+    merged = array(TYPECODE)
+    _frombytes(merged, total.tobytes())
+    return merged, list(zip(seconds.tolist(), counts.tolist()))
+
+
+def diff(old_timeline, new_timeline):
+    """
+    Returns:
+        increments (list): `(second, count)` tuples for the seconds where the
+        watch count increased, as returned by `merge`.
+    """
+    return merge(array(TYPECODE), old_timeline, new_timeline)[1]
+
+
+def apply_increments(total_timeline, increments):
+    """
+    Add increments to a total timeline, extending it if necessary.
+
+    Returns:
+        total_timeline (array)
+    """
+    size = max([second + 1 for second, _count in increments] + [len(total_timeline)])
+    if len(total_timeline) < size:
+        total_timeline = total_timeline + array(TYPECODE, [0]) * (size - len(total_timeline))
+    for second, count in increments:
+        total_timeline[second] += count
+    return total_timeline
+
+
+def parse_ranges(ranges):
+    """
+    Validate ranges sent by the browser.
+
+    Args:
+        ranges (list): `[start, end]` pairs of seconds, where `end` is
+        excluded.
+    Returns:
+        ranges (list): `(start, end)` tuples, clamped to `MAX_SECONDS`;
+        empty ranges are dropped.
+    Raises:
+        ValueError, TypeError: on malformed ranges
+    """
+    parsed = []
+    for start, end in ranges:
+        start, end = max(0, int(start)), min(MAX_SECONDS, int(end))
+        if start < end:
+            parsed.append((start, end))
+    return parsed
+
+
+def decode_ranges(value):
+    """
+    Args:
+        value (str): comma-separated "start-end" ranges
+    Returns:
+        ranges (list): `(start, end)` tuples
+    """
+    if not value:
+        return []
+    return [tuple(int(second) for second in item.split("-")) for item in value.split(",")]
+
+
+def encode_ranges(ranges):
+    return ",".join("{}-{}".format(start, end) for start, end in ranges)
+
+
+def union_ranges(ranges, new_ranges):
+    """
+    Returns:
+        ranges (list): sorted, disjoint and non-adjacent ranges that cover
+        both arguments.
+    """
+    union = []
+    for start, end in sorted(ranges + new_ranges):
+        if union and start <= union[-1][1]:
+            if end > union[-1][1]:
+                union[-1] = (union[-1][0], end)
+        else:
+            union.append((start, end))
+    return union
+
+
+def range_increments(ranges):
+    """
+    Returns:
+        increments (list): `(second, 1)` tuples, in the format returned by
+        `merge`, for every second of the ranges.
+    """
+    return [(second, 1) for start, end in ranges for second in range(start, end)]
+
+
+def bin_width(length):
+    """
+    Number of seconds per heatmap bin, such that there are at most
+    `MAX_BARS` bins.
+    """
+    return max(1, (length + MAX_BARS - 1) // MAX_BARS)
+
+
+def make_heatmap(total_timeline):
+    """
+    Downsample a total timeline.
+
+    Returns:
+        heatmap (dict): video `length` in seconds, bin `width` in seconds and
+        watch count sum of each bin (`bins`).
+    """
+    length = len(total_timeline)
+    width = bin_width(length)
+    bins = [0] * ((length + width - 1) // width)
+    for second, count in enumerate(total_timeline):
+        bins[second // width] += count
+    return {'length': length, 'width': width, 'bins': bins}
+
+
+def update_heatmap(heatmap, total_timeline, increments):
+    """
+    Apply the increments returned by `merge` to a heatmap. The heatmap is
+    only rebuilt from scratch when the length of the timeline changed.
+
+    Returns:
+        heatmap (dict)
+    """
+    if heatmap is None or heatmap['length'] != len(total_timeline):
+        return make_heatmap(total_timeline)
+    width = heatmap['width']
+    bins = heatmap['bins']
+    for second, count in increments:
+        bins[second // width] += count
+    return heatmap
+
+
+def render_heatmap(heatmap):
+    """
+    Scale heatmap bins to bar heights between 2 and 12. Bins are compared by
+    their mean watch count, such that the last bin, which may be narrower
+    than the others, is not lower. Short videos are upsampled such that there
+    are at least `MIN_BARS` bars.
+
+    Returns:
+        bars (list): `[time, height]` pairs, where `time` is the first second
+        of the bar; it is fractional for upsampled bars.
+        size (int): number of bars
+    """
+    bins = heatmap['bins']
+    if not bins:
+        return [], 1
+    width = heatmap['width']
+    length = heatmap['length']
+    means = [
+        float(count) / min(width, length - index * width)
+        for index, count in enumerate(bins)
+    ]
+    repeat = 1
+    if len(bins) < MIN_BARS:
+        repeat = MAX_BARS // len(bins)
+    max_mean = max(means)
+    heights = [int(mean / max_mean * 10) + 2 for mean in means] if max_mean > 0 else list(bins)
+    bars = [
+        [index * width + float(step) * width / repeat if repeat > 1 else index * width, height]
+        for index, height in enumerate(heights)
+        for step in range(repeat)
+    ]
+    return bars, len(bars)
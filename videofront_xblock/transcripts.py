@@ -0,0 +1,82 @@
+"""
+Transcript cue indexes.
+
+Subtitles are parsed once on the server into a compact index of cues, sorted
+by start time, such that the browser can find the active cue with a binary
+search instead of scanning the DOM.
+"""
+import re
+import threading
+
+import requests
+
+try:
+    from html import unescape
+except ImportError:
+    from HTMLParser import HTMLParser
+    unescape = HTMLParser().unescape
+
+TIMESTAMP = r'(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{3})'
+CUE_TIMINGS = re.compile(TIMESTAMP + r'\s+-->\s+' + TIMESTAMP)
+BLOCK_SEPARATOR = re.compile(r'\r?\n[ \t]*\r?\n')
+# Voice, class and timestamp tags of cue payloads
+TAG = re.compile(r'<[^>]*>')
+
+
+def timestamp_seconds(hours, minutes, seconds, milliseconds):
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) + int(milliseconds) / 1000.
+
+
+def parse_webvtt(content):
+    """
+    Args:
+        content (unicode): WebVTT file. SRT files are parsed too.
+    Returns:
+        index (dict): `starts` and `ends` times (in seconds) and `texts` of
+        the cues, sorted by start time. Texts are plain text.
+    """
+    cues = []
+    for block in BLOCK_SEPARATOR.split(content.lstrip(u'\ufeff')):
+        lines = block.strip().splitlines()
+        for position, line in enumerate(lines):
+            match = CUE_TIMINGS.search(line)
+            if match:
+                break
+        else:
+            # Header, comment, style or region block
+            continue
+        text = u" ".join(unescape(TAG.sub(u"", line)).strip() for line in lines[position + 1:])
+        groups = match.groups()
+        cues.append((timestamp_seconds(*groups[:4]), timestamp_seconds(*groups[4:]), text))
+    cues.sort(key=lambda cue: cue[0])
+    return {
+        'starts': [cue[0] for cue in cues],
+        'ends': [cue[1] for cue in cues],
+        'texts': [cue[2] for cue in cues],
+    }
+
+
+# Subtitles are usually served by a storage host, not by the API: they are
+# fetched without the API credentials.
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session # pylint: disable=global-statement
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+    return _session
+
+
+def fetch_index(url, timeout):
+    """
+    Download and parse a subtitle file.
+
+    Raises:
+        requests.RequestException
+    """
+    response = get_session().get(url, timeout=timeout)
+    response.raise_for_status()
+    return parse_webvtt(response.content.decode('utf-8-sig', 'replace'))
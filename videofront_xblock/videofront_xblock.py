@@ -1,22 +1,191 @@
+import hmac
 import json
 import logging
-import pkg_resources
 
 from django.utils.translation import ugettext_lazy
 from django.template import Context, Template
 
 from xblock.core import XBlock
-from xblock.fields import Boolean, Scope, String, Integer
+from xblock.fields import Boolean, Dict, Scope, String, Integer
 from xblock.fragment import Fragment
 from xblockutils.studio_editable import StudioEditableXBlockMixin
 
 import requests
+from webob import Response
 
 import math
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
+import threading
+
+from .assets import (
+    CSS_RESOURCES, CSS_SEPARATOR, JS_RESOURCES, JS_SEPARATOR,
+    get_bundle_path, load_bundle, load_resource
+)
+from .cache import get_metadata_cache
+from .client import get_client, get_mirrors, rewrite_url
+from .counters import get_counters
+from .metrics import get_metrics, timed_handler
+from .refresh import get_scheduler as get_refresh_scheduler
+from . import summary as summary_fields
+from .rollups import METRICS as ROLLUP_METRICS, PERIODS as ROLLUP_PERIODS, Rollups
+from . import timeline as timeline_encoding
+from . import transcripts
 
 logger = logging.getLogger(__name__)
 
+# Default cache durations (in seconds), which can be overridden in the
+# settings bucket.
+CACHE_TTL_READY = 3600
+CACHE_TTL_PROCESSING = 10
+CACHE_TTL_NOT_FOUND = 60
+# Browser cache duration (in seconds) of the deferred video metadata
+METADATA_MAX_AGE = 60
+# Subtitle files do not change once a video is processed
+CACHE_TTL_TRANSCRIPT = 24 * 3600
+TRANSCRIPT_MAX_AGE = 3600
+# Background refresh of videos that are being processed: delays (in seconds)
+# between two polls, and how long to poll before giving up
+REFRESH_INITIAL_DELAY = 5
+REFRESH_MAX_DELAY = 300
+REFRESH_TIMEOUT = 6 * 3600
+
+def fetch_video_metadata(settings, video_id):
+    """
+    Fetch the video object from the Videofront API.
+
+    Returns:
+        result (tuple): `(status_code, video)`, where `status_code` is None
+        if the server could not be reached.
+        timeout (int): cache duration of the result, None if the server could
+        not be reached, and 0 if the result must not be cached.
+    """
+    with get_metrics(settings).timer('upstream') as timer:
+        try:
+            api_response = get_client(settings).get_video(video_id)
+        except requests.RequestException as e:
+            logger.error("Could not connect to Videofront: %s", e)
+            timer.tags['status'] = 'unreachable'
+            return (None, {}), None
+        timer.tags['status'] = api_response.status_code
+
+    status_code = api_response.status_code
+    video = {}
+    if status_code == 404:
+        timeout = settings.get('CACHE_TTL_NOT_FOUND', CACHE_TTL_NOT_FOUND)
+    elif status_code >= 400:
+        logger.error("Received error %d: %s", status_code, api_response.content)
+        return (status_code, video), 0
+    else:
+        video = json.loads(api_response.content)
+        if video['processing']['status'] == 'processing':
+            timeout = settings.get('CACHE_TTL_PROCESSING', CACHE_TTL_PROCESSING)
+            if settings.get('BACKGROUND_REFRESH', True):
+                # The entry is kept up to date by the refresh scheduler
+                timeout = max(timeout, 2 * settings.get('REFRESH_MAX_DELAY', REFRESH_MAX_DELAY))
+        else:
+            timeout = settings.get('CACHE_TTL_READY', CACHE_TTL_READY)
+    return (status_code, video), timeout
+
+
+def schedule_refresh(settings, video_id, delay=None):
+    """
+    Poll the metadata of a video in the background, with exponential
+    backoff, until it is no longer being processed.
+    """
+    metadata_cache = get_metadata_cache(settings)
+    key = metadata_cache.make_key(settings['HOST'], video_id)
+
+    def refresh():
+        (status_code, video), timeout = fetch_video_metadata(settings, video_id)
+        if timeout:
+            metadata_cache.set(key, (status_code, video), timeout)
+        if status_code is None or status_code >= 500:
+            # Try again later
+            return True
+        return bool(video) and video['processing']['status'] == 'processing'
+
+    get_refresh_scheduler().schedule(
+        key, refresh,
+        delay=settings.get('REFRESH_INITIAL_DELAY', REFRESH_INITIAL_DELAY) if delay is None else delay,
+        max_delay=settings.get('REFRESH_MAX_DELAY', REFRESH_MAX_DELAY),
+        timeout=settings.get('REFRESH_TIMEOUT', REFRESH_TIMEOUT),
+    )
+
+
+def mirror_video(settings, video):
+    """
+    Args:
+        video (dict): video object, as returned by the Videofront API. It is
+        shared by the metadata cache: it is never modified.
+    Returns:
+        video (dict): copy of the video object where the URLs of the files
+        point to the best ranked mirrors (see the `MIRRORS` setting).
+    """
+    mirrors = get_mirrors(settings)
+    if not mirrors or not video:
+        return video
+    video = dict(video)
+    for key in ('thumbnail', 'poster_frames'):
+        if video.get(key):
+            video[key] = rewrite_url(mirrors, video[key])
+    for key in ('formats', 'subtitles'):
+        video[key] = [
+            dict(item, url=rewrite_url(mirrors, item['url'])) for item in video.get(key, [])
+        ]
+    return video
+
+
+def parse_bitrate(bitrate):
+    """
+    Args:
+        bitrate: number or string such as "800k" or "2M". Numbers below 100
+        are in Mbit/s, other numbers in kbit/s.
+    Returns:
+        bitrate (int): in kbit/s, or None if it is unknown.
+    """
+    if bitrate is None or bitrate == '':
+        return None
+    multiplier = 1
+    if isinstance(bitrate, (str, type(u""))):
+        bitrate = bitrate.strip().lower().rstrip('bps').rstrip('/')
+        if bitrate.endswith('m'):
+            bitrate, multiplier = bitrate[:-1], 1000
+        elif bitrate.endswith('k'):
+            bitrate = bitrate[:-1]
+    try:
+        bitrate = float(bitrate) * multiplier
+    except ValueError:
+        return None
+    if multiplier == 1 and bitrate < 100:
+        bitrate *= 1000
+    return int(bitrate) if bitrate > 0 else None
+
+
+# Compiled templates are loaded once per process
+_templates = {}
+
+
+def load_template(path):
+    """Compiled Django template from a package resource."""
+    template = _templates.get(path)
+    if template is None:
+        template = _templates[path] = Template(load_resource(path))
+    return template
+
+
+# Thread pool used to fetch the metadata of all videos of a page concurrently
+_prefetch_pool = None
+_prefetch_pool_lock = threading.Lock()
+
+
+def get_prefetch_pool(size):
+    global _prefetch_pool # pylint: disable=global-statement
+    with _prefetch_pool_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPool(size)
+    return _prefetch_pool
+
 
 @XBlock.needs('settings')
 class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
@@ -66,7 +235,13 @@ class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
 
     # Analytics data
     user_timeline = String(default="0", scope=Scope.user_state)
+    # Seconds watched by the user, see timeline.encode_ranges
+    user_watched = String(default="", scope=Scope.user_state)
+    # Last position (in seconds) reported by the player
+    resume_position = Integer(default=0, scope=Scope.user_state)
     total_timeline = String(default="0", scope=Scope.user_state_summary)
+    # Downsampled total timeline, see timeline.make_heatmap
+    timeline_heatmap = String(default="", scope=Scope.user_state_summary)
     user_watch_time = Integer(default=0, scope=Scope.user_state)
     total_watch_time = Integer(default=0, scope=Scope.user_state_summary)
     last_watch_date = Integer(default=0, scope=Scope.user_state)
@@ -75,6 +250,8 @@ class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
     video_downloads = Integer(default=0, scope=Scope.user_state_summary)
     transcript_downloads = Integer(default=0, scope=Scope.user_state_summary)
     most_used_controls = String(default="0,0,0,0,0,0,0,0,0,0,0",scope=Scope.user_state_summary)
+    # Hourly or daily counts, see rollups.Rollups
+    analytics_rollups = String(default="", scope=Scope.user_state_summary)
     # 0 - play/pause
     # 1 - volume change
     # 2 - rate change
@@ -86,57 +263,90 @@ class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
     # 8 - pip
     # 9 - download video
     # 10 - download transcript
+    # Number of aggregate compactions applied to the summary fields, see
+    # compact_aggregates
+    counters_generation = Integer(default=0, scope=Scope.user_state_summary)
+    # Values of the aggregate counters at the latest compaction, see
+    # counters.AggregateCounters.drain
+    counters_cursors = Dict(default={}, scope=Scope.user_state_summary)
+
+    # Summary fields that are counters
+    summary_counters = summary_fields.COUNTERS
+    controls_count = len(summary_fields.CONTROLS)
+    # Other fields that are updated by `compact_aggregates`
+    compacted_fields = (
+        'most_used_controls', 'analytics_rollups', 'total_timeline', 'timeline_heatmap', 'counters_generation',
+        'counters_cursors',
+    )
+    # Memoized value of get_summary
+    _summary = None
 
     def get_icon_class(self):
         """CSS class to be used in courseware sequence list."""
         return 'video'
 
-    def build_fragment(self):
+    def build_fragment(self, author_view=False):
         # 1) Define context
-        final_timeline, final_size = self.calculateTimeline(self.total_timeline.split(","))
+        # Analytics are not part of the context: they are loaded from the
+        # `analytics` handler when the analytics panel is opened.
+        summary = self.get_summary()
         context = {
             'display_name': self.display_name,
-            'like_count': self.like_count,
-            'dislike_count': self.dislike_count,
+            'like_count': summary['like_count'],
+            'dislike_count': summary['dislike_count'],
             'liked': self.liked,
             'disliked': self.disliked,
             'reported': self.aud_reported or self.vid_reported,
-            'aud_rep_cnt': self.aud_rep_cnt,
-            'vid_rep_cnt': self.vid_rep_cnt,
-            'total_timeline': final_timeline,
-            'timeline_bar_width': 60.0/final_size,
-            'total_views': self.total_views,
-            'most_used_controls': self.calculateMostUsedControls(),
-            'user_views': self.user_views,
-            'last_watch_date': datetime.utcfromtimestamp(self.last_watch_date).strftime('%d-%m-%Y'),
-            'video_downloads_cnt': self.video_downloads,
-            'transcript_downloads_cnt':self.transcript_downloads,
+            'aud_rep_cnt': summary['aud_rep_cnt'],
+            'vid_rep_cnt': summary['vid_rep_cnt'],
+            'show_analytics': author_view or self.can_view_analytics(),
         }
         # It is a common mistake to define video ids suffixed with empty spaces
         video_id = None if self.video_id is None else self.video_id.strip()
-        context['video'], context['messages'], poster_frames = self.get_video_context(video_id)
+        if self.is_deferred_render():
+            # Video sources, subtitles and downloads are loaded by the
+            # javascript from the `video_metadata` handler
+            context['deferred'] = True
+            context['video'], context['messages'], poster_frames = {}, [], ""
+        else:
+            context['video'], context['messages'], poster_frames = self.get_video_context(video_id)
+        context['renditions'] = self.get_renditions(context['video'])
         context['video_downloads'] = self.get_video_downloads_context(context['video']) if self.allow_download else []
         context['transcript_downloads'] = self.get_transcript_downloads_context(context['video']) if self.allow_download else []
 
         # 2) Render template
-        template = Template(self.resource_string("public/html/xblock.html"))
-        content = template.render(Context(context))
+        template = load_template("public/html/xblock.html")
+        with self.get_metrics().timer('template.render', template='xblock'):
+            content = template.render(Context(context))
 
         # 3) Build fragment
         fragment = Fragment()
         fragment.add_content(content)
-        fragment.add_css(self.resource_string('public/css/xblock.css'))
-        fragment.add_css(self.resource_string('public/css/vendor/videojs-resolution-switcher.css'))
-        fragment.add_css(self.resource_string('public/css/vendor/videojs-seek-buttons.css'))
-        fragment.add_css(self.resource_string('public/css/vendor/videojs-vtt-thumbnails.css'))
+        self.add_assets(fragment)
+        return fragment, video_id, poster_frames
+
+    def add_assets(self, fragment):
+        """
+        Add CSS and JS to the fragment. When available, the minified bundles
+        from `public/dist` are served as static files, which can be cached by
+        browsers; otherwise the bundles are inlined in the fragment.
+        """
+        settings = self.get_settings_bucket()
         fragment.add_css_url('https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css')
         fragment.add_css_url('https://vjs.zencdn.net/7.4.1/video-js.css')
         fragment.add_javascript_url('https://vjs.zencdn.net/7.4.1/video.js')
-        fragment.add_javascript(self.resource_string('public/js/xblock.js'))
-        fragment.add_javascript(self.resource_string('public/js/vendor/videojs-resolution-switcher.js'))
-        fragment.add_javascript(self.resource_string('public/js/vendor/videojs-seek-buttons.min.js'))
-        fragment.add_javascript(self.resource_string('public/js/vendor/videojs-vtt-thumbnails.min.js'))
-        return fragment, video_id, poster_frames
+
+        use_bundles = settings.get('ASSET_BUNDLE', True)
+        css_path = get_bundle_path(CSS_RESOURCES, CSS_SEPARATOR, 'css') if use_bundles else None
+        js_path = get_bundle_path(JS_RESOURCES, JS_SEPARATOR, 'js') if use_bundles else None
+        if css_path:
+            fragment.add_css_url(self.runtime.local_resource_url(self, css_path))
+        else:
+            fragment.add_css(load_bundle(CSS_RESOURCES, CSS_SEPARATOR))
+        if js_path:
+            fragment.add_javascript_url(self.runtime.local_resource_url(self, js_path))
+        else:
+            fragment.add_javascript(load_bundle(JS_RESOURCES, JS_SEPARATOR))
 
     def student_view(self, context=None): # pylint: disable=W0613
         fragment, video_id, poster_frames = self.build_fragment()
@@ -145,28 +355,86 @@ class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
             'course_id': unicode(self.location.course_key) if hasattr(self, 'location') else '',
             'video_id': video_id,
             'poster_frames': poster_frames,
-            'avg_watch_time': self.calc_total_watch_time()
+            'deferred': self.is_deferred_render(),
+            'resume_position': self.get_resume_position(),
+            'adaptive': self.get_settings_bucket().get('ADAPTIVE_BITRATE', True),
         })
 
         return fragment
 
     def author_view(self, context=None): # pylint: disable=W0613
-        fragment, video_id, poster_frames = self.build_fragment()
+        fragment, video_id, poster_frames = self.build_fragment(author_view=True)
         fragment.add_css(self.resource_string('public/css/xblock_author_css.css'))
 
         fragment.initialize_js('VideofrontXBlock', json_args={
             'course_id': unicode(self.location.course_key) if hasattr(self, 'location') else '',
             'video_id': video_id,
             'poster_frames': poster_frames,
-            'avg_watch_time': self.calc_total_watch_time()
+            'deferred': self.is_deferred_render(),
         })
 
         return fragment
 
+    def can_view_analytics(self):
+        """
+        Analytics are visible to everyone, unless ANALYTICS_STAFF_ONLY is set
+        in the settings bucket.
+        """
+        if not self.get_settings_bucket().get('ANALYTICS_STAFF_ONLY', False):
+            return True
+        return getattr(self.runtime, 'user_is_staff', False) or getattr(self.runtime, 'is_author_mode', False)
+
+    def get_analytics_context(self):
+        final_timeline, final_size = self.calculateTimeline()
+        summary = self.get_summary()
+        return {
+            'total_timeline': final_timeline,
+            'timeline_bar_width': 60.0/final_size,
+            'total_views': summary['total_views'],
+            'most_used_controls': self.calculateMostUsedControls(),
+            'user_views': self.user_views,
+            'last_watch_date': datetime.utcfromtimestamp(self.last_watch_date).strftime('%d-%m-%Y'),
+            'video_downloads_cnt': summary['video_downloads'],
+            'transcript_downloads_cnt': summary['transcript_downloads'],
+            'trends': self.get_trends(),
+        }
+
+    @timed_handler
+    @XBlock.json_handler
+    def analytics(self, data, suffix=''): # pylint: disable=unused-argument
+        """
+        Content of the analytics panel, computed on demand.
+        """
+        if not self.can_view_analytics():
+            return {'error': u"{}".format(ugettext_lazy("You are not allowed to view analytics."))}
+        template = load_template("public/html/analytics.html")
+        return {
+            'html': template.render(Context(self.get_analytics_context())),
+            'avg_watch_time': self.calc_total_watch_time(),
+        }
+
+    def save(self):
+        """
+        Timed save of the field data. The runtime saves the fields after every
+        handler call, and compactions save them too.
+        """
+        with self.get_metrics().timer('field_data.save'):
+            super(VideofrontXBlock, self).save()
+
+    def get_settings_bucket(self):
+        """Open edX settings for this XBlock, from `XBLOCK_SETTINGS`."""
+        return self.runtime.service(self, "settings").get_settings_bucket(self)
+
+    def is_deferred_render(self):
+        """
+        In deferred mode, views are rendered without waiting for Videofront:
+        video metadata are then loaded by the browser.
+        """
+        return self.get_settings_bucket().get('DEFERRED_RENDER', False)
+
     def resource_string(self, path):
         """Handy helper for getting resources from our kit."""
-        data = pkg_resources.resource_string(__name__, path)
-        return data.decode('utf8')
+        return load_resource(path)
 
     @staticmethod
     def workbench_scenarios():
@@ -178,6 +446,16 @@ class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
         ]
 
     def get_video_context(self, video_id):
+        """
+        Timed version of `load_video_context`, where the outcome is the level
+        of the first message, if any.
+        """
+        with self.get_metrics().timer('video_context') as timer:
+            video, messages, poster_frames = self.load_video_context(video_id)
+            timer.tags['outcome'] = messages[0][0] if messages else 'ok'
+        return video, messages, poster_frames
+
+    def load_video_context(self, video_id):
         """
         The return values will be used in the view context.
 
@@ -193,7 +471,7 @@ class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
         if not video_id:
             messages.append(('warning', ugettext_lazy("You need to define a valid Videofront video ID.")))
             return video, messages, poster_frames
-        settings = self.runtime.service(self, "settings").get_settings_bucket(self)
+        settings = self.get_settings_bucket()
         api_host = settings.get('HOST')
         api_token = settings.get('TOKEN')
         if not api_host:
@@ -209,35 +487,26 @@ class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
             ))
             return video, messages, poster_frames
 
-
-        try:
-            # TODO implement a cache to store the server responses: we don't
-            # want to make a call to videofront for every video view.
-            api_response = requests.get(
-                '{}/api/v1/videos/{}/'.format(api_host, video_id),
-                headers={'Authorization': 'Token ' + api_token}
-            )
-        except requests.ConnectionError as e:
+        if settings.get('PREFETCH', True):
+            self.prefetch_sibling_videos(settings, video_id)
+        status_code, video = self.get_video_metadata(settings, video_id)
+        if status_code is None:
             messages.append((
                 'error',
                 ugettext_lazy("Could not reach Videofront server. Contact your platform administrator")
             ))
-            logger.error("Could not connect to Videofront: %s", e)
-            return video, messages, poster_frames
+            return {}, messages, poster_frames
 
-        if api_response.status_code >= 400:
-            if api_response.status_code == 403:
+        if status_code >= 400:
+            if status_code == 403:
                 messages.append(('error', ugettext_lazy("Authentication error")))
-            elif api_response.status_code == 404:
+            elif status_code == 404:
                 messages.append(('warning', ugettext_lazy("Incorrect video id")))
             else:
                 messages.append(('error', ugettext_lazy("An unknown error has occurred")))
-                logger.error("Received error %d: %s", api_response.status_code, api_response.content)
-            return video, messages, poster_frames
+            return {}, messages, poster_frames
 
         # Check processing status is correct
-        video = json.loads(api_response.content)
-        poster_frames = video['poster_frames']
         processing_status = video['processing']['status']
         if processing_status == 'processing':
             messages.append((
@@ -250,8 +519,274 @@ class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
                 ugettext_lazy("Video processing failed: try again with a different video ID")
             ))
 
+        video = mirror_video(settings, video)
+        poster_frames = video['poster_frames']
         return video, messages, poster_frames
 
+    def prefetch_sibling_videos(self, settings, video_id):
+        """
+        Fetch the metadata of all the Videofront videos of the parent block
+        (vertical, sequence...) concurrently, such that rendering a page with
+        many videos costs about one upstream round-trip instead of one per
+        video. This is done by the first block to be rendered: afterwards, the
+        metadata of the other blocks is found in the cache.
+        """
+        metadata_cache = get_metadata_cache(settings)
+        if metadata_cache.is_fresh(metadata_cache.make_key(settings['HOST'], video_id)):
+            return
+        try:
+            parent = self.get_parent()
+            if parent is None:
+                return
+            video_ids = set()
+            for child_id in parent.children:
+                child = self.runtime.get_block(child_id)
+                if isinstance(child, VideofrontXBlock) and child.video_id:
+                    video_ids.add(child.video_id.strip())
+        except Exception: # pylint: disable=broad-except
+            # Prefetching is an optimization: it should never break rendering
+            logger.exception("Could not list sibling Videofront videos")
+            return
+        video_ids.discard(video_id)
+        video_ids = [
+            sibling_id for sibling_id in video_ids
+            if not metadata_cache.is_fresh(metadata_cache.make_key(settings['HOST'], sibling_id))
+        ]
+        if not video_ids:
+            return
+        # The metadata of the current video is fetched concurrently too
+        video_ids.append(video_id)
+        pool = get_prefetch_pool(settings.get('PREFETCH_WORKERS', 8))
+        pool.map(lambda sibling_id: self.get_video_metadata(settings, sibling_id), video_ids)
+
+    def get_video_metadata(self, settings, video_id):
+        """
+        Fetch the video object from the Videofront API, going through the
+        metadata cache first.
+
+        Successful responses are cached for a short time while the video is
+        being processed and for a long time once it is ready. 404 responses
+        are cached too, such that incorrect video ids do not hit the server on
+        every view. Other errors are never cached. When the server cannot be
+        reached (or the circuit breaker is open), a stale cached response is
+        returned if there is one.
+
+        Returns:
+            status_code (int): HTTP status code, or None if the server could
+            not be reached.
+            video (dict): decoded video object; empty in case of error.
+        """
+        fetched = []
+
+        def fetch():
+            fetched.append(True)
+            return fetch_video_metadata(settings, video_id)
+
+        metadata_cache = get_metadata_cache(settings)
+        status_code, video = metadata_cache.get_or_fetch(
+            metadata_cache.make_key(settings['HOST'], video_id), fetch
+        )
+        get_metrics(settings).incr('metadata_cache', result='miss' if fetched else 'hit')
+        if video and video['processing']['status'] == 'processing' and settings.get('BACKGROUND_REFRESH', True):
+            schedule_refresh(settings, video_id)
+        return status_code, video
+
+    @timed_handler
+    @XBlock.handler
+    def invalidate(self, request, suffix=''): # pylint: disable=unused-argument
+        """
+        Evict the metadata of a video from the cache, e.g. when Videofront
+        notifies that processing is over. The request must be a POST with the
+        `INVALIDATION_TOKEN` of the settings bucket in an "Authorization:
+        Token <token>" header. The video id is read from the JSON body
+        (`{"video_id": ...}`) and defaults to the video of the block, such
+        that the handler of any block can be used as a webhook.
+
+        Invalidation requires the 'django' `CACHE_BACKEND`: the request is
+        received by a single worker, which could not evict the entries of the
+        other workers from their local caches. With the 'local' backend, the
+        handler fails with a 409 status.
+        """
+        settings = self.get_settings_bucket()
+        token = settings.get('INVALIDATION_TOKEN')
+        authorization = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(
+                authorization.encode('utf8'), u"Token {}".format(token).encode('utf8')
+        ):
+            return Response(status=403)
+        if request.method != 'POST':
+            return Response(status=405)
+        try:
+            data = json.loads(request.body.decode('utf8')) if request.body else {}
+            video_id = (data.get('video_id') or self.video_id or "").strip()
+        except (ValueError, AttributeError):
+            return Response(status=400)
+        if not video_id or not settings.get('HOST'):
+            return Response(status=400)
+        if settings.get('CACHE_BACKEND', 'local') != 'django':
+            logger.warning("Cannot invalidate the metadata of video %s: CACHE_BACKEND is not 'django'", video_id)
+            return Response(
+                json.dumps({'error': "Invalidation requires the 'django' cache backend"}),
+                status=409, content_type='application/json', charset='utf8'
+            )
+        self.invalidate_video_metadata(settings, video_id)
+        return Response(json.dumps({'invalidated': video_id}), content_type='application/json', charset='utf8')
+
+    def invalidate_video_metadata(self, settings, video_id):
+        """
+        Evict the metadata and the transcripts of a video from the cache. With
+        background refresh, they are fetched again right away, such that page
+        views do not have to.
+        """
+        metadata_cache = get_metadata_cache(settings)
+        key = metadata_cache.make_key(settings['HOST'], video_id)
+        entry = metadata_cache.backend.get(key)
+        if entry is not None:
+            _status_code, video = entry['value']
+            for subtitle in video.get('subtitles', []):
+                metadata_cache.delete(metadata_cache.make_key('transcript', subtitle['url']))
+        metadata_cache.delete(key)
+        if settings.get('BACKGROUND_REFRESH', True):
+            schedule_refresh(settings, video_id, delay=0)
+
+    @timed_handler
+    @XBlock.handler
+    def video_metadata(self, request, suffix=''): # pylint: disable=unused-argument
+        """
+        Video sources, subtitles and download links, for views rendered in
+        deferred mode. The response can be stored by HTTP caches for a short
+        time.
+        """
+        video_id = None if self.video_id is None else self.video_id.strip()
+        video, messages, poster_frames = self.get_video_context(video_id)
+        data = {
+            'messages': [(level, u"{}".format(content)) for level, content in messages],
+            'thumbnail': video.get('thumbnail', ''),
+            'poster_frames': poster_frames,
+            'sources': self.get_renditions(video),
+            'subtitles': [
+                {
+                    'src': subtitle['url'],
+                    'srclang': subtitle['language'],
+                    'label': subtitle['language'],
+                }
+                for subtitle in video.get('subtitles', [])
+            ],
+            'video_downloads': self.get_video_downloads_context(video) if self.allow_download else [],
+            'transcript_downloads': self.get_transcript_downloads_context(video) if self.allow_download else [],
+        }
+        response = Response(json.dumps(data), content_type='application/json', charset='utf8')
+        # Do not let caches keep videos that are being processed, or errors
+        if video and video['processing']['status'] != 'processing':
+            response.cache_control.private = True
+            response.cache_control.max_age = self.get_settings_bucket().get('METADATA_MAX_AGE', METADATA_MAX_AGE)
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+    @timed_handler
+    @XBlock.handler
+    def transcript(self, request, suffix=''): # pylint: disable=unused-argument
+        """
+        Cue index of the subtitles of the video in the language given as
+        suffix, as returned by `transcripts.parse_webvtt`.
+        """
+        settings = self.get_settings_bucket()
+        video_id = None if self.video_id is None else self.video_id.strip()
+        video = {}
+        if video_id and settings.get('HOST') and settings.get('TOKEN'):
+            _status_code, video = self.get_video_metadata(settings, video_id)
+        urls = dict((subtitle['language'], subtitle['url']) for subtitle in video.get('subtitles', []))
+        if suffix not in urls:
+            return Response(
+                json.dumps({'error': 'Unknown transcript language'}),
+                status=404, content_type='application/json', charset='utf8'
+            )
+        content = self.get_transcript_json(settings, urls[suffix])
+        if content is None:
+            response = Response(
+                json.dumps({'error': 'Could not load transcript'}),
+                status=502, content_type='application/json', charset='utf8'
+            )
+            response.cache_control.no_cache = True
+            return response
+        response = Response(content, content_type='application/json', charset='utf8')
+        response.cache_control.private = True
+        response.cache_control.max_age = settings.get('TRANSCRIPT_MAX_AGE', TRANSCRIPT_MAX_AGE)
+        return response
+
+    def get_transcript_json(self, settings, url):
+        """
+        Fetch and parse a subtitle file, going through the metadata cache. The
+        index is cached serialized, such that it is not encoded again on every
+        request.
+
+        Returns:
+            content (str): JSON-encoded index, as returned by
+            `transcripts.parse_webvtt`, or None if the file could not be
+            loaded.
+        """
+        def fetch():
+            timeout = (settings.get('CONNECT_TIMEOUT', 3.05), settings.get('READ_TIMEOUT', 10))
+            try:
+                index = transcripts.fetch_index(url, timeout)
+            except requests.RequestException as e:
+                logger.error("Could not load transcript %s: %s", url, e)
+                return None, None
+            return json.dumps(index), settings.get('CACHE_TTL_TRANSCRIPT', CACHE_TTL_TRANSCRIPT)
+
+        metadata_cache = get_metadata_cache(settings)
+        return metadata_cache.get_or_fetch(metadata_cache.make_key('transcript', url), fetch)
+
+    @timed_handler
+    @XBlock.handler
+    def manifest(self, request, suffix=''): # pylint: disable=unused-argument
+        """
+        Renditions of the video, from which the player picks the best one
+        for the bandwidth of the learner.
+        """
+        settings = self.get_settings_bucket()
+        video_id = None if self.video_id is None else self.video_id.strip()
+        video = {}
+        if video_id and settings.get('HOST') and settings.get('TOKEN'):
+            _status_code, video = self.get_video_metadata(settings, video_id)
+            video = mirror_video(settings, video)
+        response = Response(
+            json.dumps({'renditions': self.get_renditions(video)}),
+            content_type='application/json', charset='utf8'
+        )
+        if video and video['processing']['status'] != 'processing':
+            response.cache_control.private = True
+            response.cache_control.max_age = settings.get('METADATA_MAX_AGE', METADATA_MAX_AGE)
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+    def get_renditions(self, video):
+        """
+        Args:
+            video (dict): object as returned by `get_video_context`
+        Returns:
+            renditions (list): video sources, by increasing bitrate. The `res`
+            of each source is its bitrate in kbit/s, or None if unknown.
+        """
+        format_order = ['LD', 'SD', 'HD']
+        renditions = [
+            {
+                'src': source['url'],
+                'type': 'video/mp4',
+                'label': source['name'],
+                'res': parse_bitrate(source.get('bitrate')),
+            }
+            for source in video.get('formats', [])
+        ]
+        renditions.sort(key=lambda rendition: (
+            rendition['res'] is None,
+            rendition['res'],
+            format_order.index(rendition['label']) if rendition['label'] in format_order else len(format_order),
+        ))
+        return renditions
+
     def get_video_downloads_context(self, video):
         """
         Args:
@@ -294,65 +829,26 @@ class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
             for source in subtitles
         ]
 
-    def calculateTimeline(self, total_timeline, count=0):
-        t_size = len(total_timeline)
-        final_size = 1
-        if t_size == 0 or self.total_views < 5:
-            return [], final_size
-        total_timeline = [float(x) for x in total_timeline]
-        n_timeline = []
-        usable_factors = []
-        offset = 0
-        if t_size >= 60:
-            while (len(usable_factors) == 0):
-                factors = self.calculateFactors(t_size + offset)
-                usable_factors = [f for f in factors if t_size/f >= 60 and t_size/f <= 240]
-                offset -= 1
-            final_factor = min(usable_factors)
-            final_size = t_size / final_factor
-            for i in range(0, t_size, final_factor):
-                temp = 0
-                for j in range(0, final_factor):
-                    if i >= t_size:
-                        break
-                    temp += total_timeline[i]
-                    i += 1
-                n_timeline.append(temp)
-        else:
-            while (len(usable_factors) == 0):
-                factors = self.calculateFactors(t_size + offset)
-                usable_factors = [f for f in factors if t_size*f >= 60 and t_size*f <= 240]
-                offset -= 1
-            final_factor = max(usable_factors)
-            final_size = t_size * final_factor
-            for t in total_timeline:
-                for j in range(0, final_factor):
-                    n_timeline.append(t)
-        max_h = max(n_timeline)
-        if max_h > 0:
-            n_timeline = [ int(x/max_h * 10) + 2 for x in n_timeline]
-        if t_size >= 60:
-            n_timeline = [[i*final_factor, x] for i, x in enumerate(n_timeline)]
-        else:
-            n_timeline = [[i/final_factor, x] for i, x in enumerate(n_timeline)]
-        return n_timeline, final_size
+    def calculateTimeline(self):
+        """
+        Returns:
+            bars (list): `[time, height]` pairs of the heatmap
+            size (int): number of bars
+        """
+        if self.get_summary()['total_views'] < 5:
+            return [], 1
+        return timeline_encoding.render_heatmap(self.get_heatmap())
 
-    def calculateFactors(self, num):
-        factors = []
-        for n in range(1, num/2+1):
-            if num % n == 0:
-                factors.append(n)
-        factors.append(num)
-        return factors
+    def get_heatmap(self):
+        if self.timeline_heatmap:
+            return json.loads(self.timeline_heatmap)
+        # Heatmaps of timelines saved before heatmaps were stored are computed
+        # on the fly, until the next save.
+        return timeline_encoding.make_heatmap(timeline_encoding.decode(self.total_timeline))
 
     def calculateMostUsedControls(self):
-        controls = {
-            0: 'Play/Pause', 1: 'Volume Change', 2: 'Playback Rate Change',
-            3: 'Seeking', 4: 'Subtitles Toggle', 5: 'Transcript Toggle',
-            6: 'Like/Dislike', 7: 'Report', 8: 'Picture in Picture',
-            9: 'Video Download', 10: 'Transcript Download'
-        }
-        most_used = self.most_used_controls.split(",")
+        controls = summary_fields.CONTROLS
+        most_used = self.get_summary()['most_used_controls']
         most_used_dict = {}
         for i in range(0, len(most_used)):
             most_used_dict[i] = int(most_used[i])
@@ -366,64 +862,389 @@ class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
         return final_list[0:4]
 
     def calc_total_watch_time(self):
-            if self.total_views > 0 :
-                return self.total_watch_time / self.total_views
+            summary = self.get_summary()
+            if summary['total_views'] > 0 :
+                return summary['total_watch_time'] / summary['total_views']
             else:
                 return 0
 
+    def get_summary(self):
+        """
+        Current value of the summary counters, including the increments that
+        were not compacted yet.
+
+        Returns:
+            summary (dict): value of each of the `summary_counters`, and
+            `most_used_controls` as a list of counts.
+        """
+        if self._summary is not None:
+            return self._summary
+        summary = dict((name, getattr(self, name)) for name in self.summary_counters)
+        controls = summary_fields.decode_controls(self.most_used_controls)
+        counters = self.get_counters()
+        if counters is not None:
+            pending = counters.pending(self.counters_scope, self.get_counter_names(), self.counters_cursors)
+            for name in self.summary_counters:
+                summary[name] += pending[name]
+            for index in range(self.controls_count):
+                controls[index] += pending[summary_fields.control_counter_name(index)]
+        summary['most_used_controls'] = controls
+        self._summary = summary
+        return summary
+
+    def get_counters(self):
+        """Aggregate counters, or None if they are disabled."""
+        return get_counters(self.get_settings_bucket())
+
+    def get_metrics(self):
+        """Metrics configured in the settings bucket (disabled by default)."""
+        return get_metrics(self.get_settings_bucket())
+
+    @property
+    def counters_scope(self):
+        return u"{}".format(self.scope_ids.usage_id)
+
+    def get_counter_names(self):
+        return summary_fields.get_counter_names()
+
+    def get_rollups(self):
+        """
+        Rollups configured by the `ROLLUP_PERIOD` ('hourly' or 'daily') and
+        `ROLLUP_SIZE` (number of periods that are kept) settings.
+        """
+        settings = self.get_settings_bucket()
+        period_name = settings.get('ROLLUP_PERIOD', 'daily')
+        if period_name not in ROLLUP_PERIODS:
+            raise ValueError("Unknown Videofront rollup period: {}".format(period_name))
+        return Rollups.decode(self.analytics_rollups, ROLLUP_PERIODS[period_name], settings.get('ROLLUP_SIZE', 30))
+
+    @staticmethod
+    def rollup_counter_name(period_number, metric):
+        return 'rollup.{}.{}'.format(period_number, metric)
+
+    def get_rollup_counter_names(self, periods):
+        return [self.rollup_counter_name(period_number, metric) for period_number in periods for metric in ROLLUP_METRICS]
+
+    def record_rollup(self, metric, delta=1):
+        """
+        Add to the count of `metric` in the current period. Like summary
+        counters, the increment is applied on the next compaction when
+        aggregate counters are enabled.
+        """
+        if not delta:
+            return
+        counters = self.get_counters()
+        rollups = self.get_rollups()
+        if counters is None:
+            rollups.add(rollups.period_at(), metric, delta)
+            self.analytics_rollups = rollups.encode()
+        else:
+            period_number = rollups.period_at()
+            counters.incr(self.counters_scope, self.rollup_counter_name(period_number, metric), delta)
+            # Marked after the increment, such that compactions cannot miss it
+            counters.mark(self.counters_scope, 'rollup_periods', period_number)
+
+    def get_trends(self):
+        """
+        Returns:
+            trends (list): one dict per metric, with its `total` over the
+            rollup periods and its `bars`: `[period start, count, height]`
+            triplets, where the height is between 1 and 12.
+        """
+        rollups = self.get_rollups()
+        pending = {}
+        counters = self.get_counters()
+        if counters is not None:
+            periods = counters.marked(self.counters_scope, 'rollup_periods')
+            pending = counters.pending(
+                self.counters_scope, self.get_rollup_counter_names(periods), self.counters_cursors
+            )
+        labels = {
+            'views': ugettext_lazy("Views"),
+            'watch_time': ugettext_lazy("Watch time (minutes)"),
+            'controls': ugettext_lazy("Controls used"),
+            'video_downloads': ugettext_lazy("Video downloads"),
+            'transcript_downloads': ugettext_lazy("Transcript downloads"),
+        }
+        date_format = '%d-%m-%Y %H:00' if rollups.period < ROLLUP_PERIODS['daily'] else '%d-%m-%Y'
+        trends = []
+        for metric in ROLLUP_METRICS:
+            series = [
+                (start, count + pending.get(self.rollup_counter_name(start // rollups.period, metric), 0))
+                for start, count in rollups.series(metric)
+            ]
+            if metric == 'watch_time':
+                series = [(start, count // 60) for start, count in series]
+            max_count = max(count for _start, count in series)
+            trends.append({
+                'label': labels[metric],
+                'total': sum(count for _start, count in series),
+                'bars': [
+                    [
+                        datetime.utcfromtimestamp(start).strftime(date_format),
+                        count,
+                        int(float(count) / max_count * 11) + 1 if max_count > 0 else 1,
+                    ]
+                    for start, count in series
+                ],
+            })
+        return trends
+
+    def incr_summary(self, name, delta=1):
+        """
+        Increment a summary counter. With aggregate counters, the increment
+        is atomic and is applied to the field on the next compaction.
+        """
+        self._summary = None
+        counters = self.get_counters()
+        if counters is None:
+            setattr(self, name, getattr(self, name) + delta)
+        else:
+            counters.incr(self.counters_scope, name, delta)
+
+    def reload_compacted_fields(self):
+        """
+        Read again, from the field data, the fields that compactions write.
+        Runtimes may load fields lazily: the summary fields could have been
+        read before another compaction, and `counters_generation` after it.
+        With aggregate counters, these fields are only written by
+        compactions, so no change is lost.
+        """
+        self._summary = None
+        field_data = self._field_data # pylint: disable=protected-access
+        for name in self.summary_counters + self.compacted_fields:
+            field = self.fields[name]
+            value = field.from_json(field_data.get(self, name)) if field_data.has(self, name) else field.default
+            setattr(self, name, value)
+
+    def compact_aggregates(self):
+        """
+        Apply the pending aggregate increments to the summary fields, and save
+        them. At most one handler call per block does this in a given
+        compaction interval. Compactions are numbered such that a block whose
+        summary fields were loaded before the latest compaction does not
+        overwrite them.
+        """
+        counters = self.get_counters()
+        if counters is None:
+            return
+        scope = self.counters_scope
+        if not counters.try_lock(scope):
+            return
+        if counters.get_generation(scope, self.counters_generation) != self.counters_generation:
+            return
+        if not counters.claim_generation(scope, self.counters_generation):
+            return
+        self.reload_compacted_fields()
+
+        drained, cursors = counters.drain(scope, self.get_counter_names(), self.counters_cursors)
+        for name in self.summary_counters:
+            if drained[name]:
+                setattr(self, name, getattr(self, name) + drained[name])
+        controls = summary_fields.decode_controls(self.most_used_controls)
+        for index in range(self.controls_count):
+            controls[index] += drained[summary_fields.control_counter_name(index)]
+        self.most_used_controls = ",".join(str(count) for count in controls)
+
+        rollups = self.get_rollups()
+        # Counters of the periods that are over are drained one last time, then
+        # deleted, such that storage does not grow with the number of periods.
+        # Late increments of these periods mark them again.
+        past_period = rollups.period_at() - 1
+        periods = set(counters.drain_marks(scope, 'rollup_periods'))
+        periods.update(int(name.split('.')[1]) for name in cursors if name.startswith('rollup.'))
+        periods = sorted(periods)
+        drained, cursors = counters.drain(scope, self.get_rollup_counter_names(periods), cursors)
+        cursors = counters.delete(
+            scope, self.get_rollup_counter_names(period for period in periods if period < past_period), cursors
+        )
+        if any(drained.values()):
+            for period_number in periods:
+                for metric in ROLLUP_METRICS:
+                    count = drained[self.rollup_counter_name(period_number, metric)]
+                    if count:
+                        rollups.add(period_number, metric, count)
+            self.analytics_rollups = rollups.encode()
+
+        increments = [
+            (second, count)
+            for entry in counters.drain_log(scope, 'timeline')
+            for second, count in entry
+        ]
+        if increments:
+            total_timeline = timeline_encoding.apply_increments(
+                timeline_encoding.decode(self.total_timeline), increments
+            )
+            heatmap = json.loads(self.timeline_heatmap) if self.timeline_heatmap else None
+            heatmap = timeline_encoding.update_heatmap(heatmap, total_timeline, increments)
+            self.total_timeline = timeline_encoding.encode(total_timeline)
+            self.timeline_heatmap = json.dumps(heatmap)
+
+        self.counters_cursors = cursors
+        self.counters_generation += 1
+        self.save()
+        counters.set_generation(scope, self.counters_generation)
+        self._summary = None
+
+    @timed_handler
     @XBlock.json_handler
     def like_dislike(self, data, suffix=''): # pylint: disable=unused-argument
         """
         Update the user and global rating in response to user action
         """
+        result = self.update_rating(data)
+        self.compact_aggregates()
+        return result
+
+    @timed_handler
+    @XBlock.json_handler
+    def report(self, data, suffix=''): # pylint: disable=unused-argument
+        """
+        Update the user and global report status in response to user action
+        """
+        result = self.update_report(data)
+        self.compact_aggregates()
+        return result
+
+    @timed_handler
+    @XBlock.json_handler
+    def saveTimeline(self, data, suffix=''): # pylint: disable=unused-argument
+        """
+        Update the watch data in timeline
+        """
+        result = self.update_timeline(data)
+        self.compact_aggregates()
+        return result
+
+    @timed_handler
+    @XBlock.json_handler
+    def saveTotalWatchTime(self, data, suffix=''): # pylint: disable=unused-argument
+        """
+        Return the watch data in timeline
+        """
+        result = self.update_watch_time(data)
+        self.compact_aggregates()
+        return result
+
+    @timed_handler
+    @XBlock.json_handler
+    def saveTranscriptDownloaded(self, data, suffix=''): # pylint: disable=unused-argument
+        """
+        Return the watch data in timeline
+        """
+        result = self.update_transcript_downloads(data)
+        self.compact_aggregates()
+        return result
+
+    @timed_handler
+    @XBlock.json_handler
+    def saveVideoDownloaded(self, data, suffix=''): # pylint: disable=unused-argument
+        """
+        Return the watch data in timeline
+        """
+        result = self.update_video_downloads(data)
+        self.compact_aggregates()
+        return result
+
+    @timed_handler
+    @XBlock.json_handler
+    def saveMostUsedControls(self, data, suffix=''): # pylint: disable=unused-argument
+        """
+        Return the watch data in timeline
+        """
+        result = self.update_most_used_controls(data)
+        self.compact_aggregates()
+        return result
+
+    # Analytics events that can be sent to `ingest_events`, with the method
+    # that applies them. Event data are the same as those of the individual
+    # handlers.
+    event_methods = {
+        'like_dislike': 'update_rating',
+        'report': 'update_report',
+        'timeline': 'update_timeline',
+        'watched': 'update_watched',
+        'watch_time': 'update_watch_time',
+        'transcript_download': 'update_transcript_downloads',
+        'video_download': 'update_video_downloads',
+        'controls': 'update_most_used_controls',
+    }
+
+    @timed_handler
+    @XBlock.json_handler
+    def ingest_events(self, data, suffix=''): # pylint: disable=unused-argument
+        """
+        Apply a batch of analytics events, in order. Field data are saved
+        once for the whole batch.
+
+        Args:
+            data (dict): `{"events": [{"type": ..., <event data>}, ...]}`
+        Returns:
+            results (list): return value of each event, in the same order, or
+            None for events that are unknown or malformed.
+        """
+        results = []
+        for event in data.get('events', []):
+            method = self.event_methods.get(event.get('type'))
+            if method is None:
+                logger.warning("Ignoring unknown analytics event type: %s", event.get('type'))
+                results.append(None)
+                continue
+            try:
+                results.append(getattr(self, method)(event))
+            except Exception: # pylint: disable=broad-except
+                # A malformed event must not drop the rest of the batch
+                logger.exception("Ignoring malformed analytics event: %s", event)
+                results.append(None)
+        self.compact_aggregates()
+        return {'results': results}
+
+    def update_rating(self, data):
         if data['voteType'] not in ('like', 'dislike'):
-            log.error('error!')
+            logger.error('error!')
             return
         
         if data['voteType'] == 'like':
             if self.liked:
-                self.like_count -= 1
+                self.incr_summary('like_count', -1)
                 self.liked = False
             else:
-                self.like_count += 1
+                self.incr_summary('like_count')
                 self.liked = True
                 if self.disliked:
-                    self.dislike_count -= 1
+                    self.incr_summary('dislike_count', -1)
                     self.disliked = False
         elif data['voteType'] == 'dislike':
             if self.disliked:
-                self.dislike_count -= 1
+                self.incr_summary('dislike_count', -1)
                 self.disliked = False
             else:
-                self.dislike_count += 1
+                self.incr_summary('dislike_count')
                 self.disliked = True
                 if self.liked:
-                    self.like_count -= 1
+                    self.incr_summary('like_count', -1)
                     self.liked = False
 
+        summary = self.get_summary()
         return {
-            'likes': self.like_count,
-            'dislikes': self.dislike_count,
+            'likes': summary['like_count'],
+            'dislikes': summary['dislike_count'],
             'liked': self.liked,
             'disliked': self.disliked,
         }
-    
-    @XBlock.json_handler
-    def report(self, data, suffix=''): # pylint: disable=unused-argument
-        """
-        Update the user and global report status in response to user action
-        """
+
+    def update_report(self, data):
         if data['voteType'] not in ('audio', 'video'):
-            log.error('error!')
+            logger.error('error!')
             return
         
         if data['voteType'] == 'audio':
             if not self.aud_reported:
-                self.aud_rep_cnt += 1
+                self.incr_summary('aud_rep_cnt')
                 self.aud_reported = True
         elif data['voteType'] == 'video':
             if not self.vid_reported:
-                self.vid_rep_cnt += 1
+                self.incr_summary('vid_rep_cnt')
                 self.vid_reported = True
 
         return {
@@ -431,64 +1252,100 @@ class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
             'vid_reported': self.vid_reported,
         }
 
-    @XBlock.json_handler
-    def saveTimeline(self, data, suffix=''): # pylint: disable=unused-argument
+    def update_timeline(self, data):
+        timeline = data['timeline']
+        new_timeline = timeline_encoding.parse_csv(timeline)
+        old_timeline = timeline_encoding.decode(self.user_timeline)
+        self.user_timeline = timeline_encoding.encode(new_timeline)
+        counters = self.get_counters()
+        if counters is not None:
+            increments = timeline_encoding.diff(old_timeline, new_timeline)
+            if increments:
+                counters.append(self.counters_scope, 'timeline', increments)
+            return
+
+        total_timeline = timeline_encoding.decode(self.total_timeline)
+        total_timeline, increments = timeline_encoding.merge(total_timeline, old_timeline, new_timeline)
+        heatmap = json.loads(self.timeline_heatmap) if self.timeline_heatmap else None
+        heatmap = timeline_encoding.update_heatmap(heatmap, total_timeline, increments)
+
+        self.total_timeline = timeline_encoding.encode(total_timeline)
+        self.timeline_heatmap = json.dumps(heatmap)
+
+    def update_watched(self, data):
         """
-        Update the watch data in timeline
+        Apply the seconds watched since the previous event.
+
+        Args:
+            data (dict): `ranges` of `[start, end]` seconds, current
+            `position` and `duration` of the video, in seconds.
         """
-        
-        timeline = data['timeline']
-        old_timeline = self.user_timeline.split(",")
-        new_timeline = timeline.split(",")
-        total_timeline = self.total_timeline.split(",")
-        for i in range(len(old_timeline), len(new_timeline)):
-            old_timeline.append("0")
-        for i in range(len(total_timeline), len(new_timeline)):
-            total_timeline.append("0")
-        for i in range(0,len(new_timeline)):
-            if int(old_timeline[i]) < int(new_timeline[i]):
-                total_timeline[i] = str(int(total_timeline[i]) + int(new_timeline[i]))
-
-        self.user_timeline = timeline
-        self.total_timeline = ",".join(total_timeline)
-
-        return
+        ranges = timeline_encoding.parse_ranges(data.get('ranges', []))
+        self.user_watched = timeline_encoding.encode_ranges(
+            timeline_encoding.union_ranges(timeline_encoding.decode_ranges(self.user_watched), ranges)
+        )
+        if data.get('position') is not None:
+            self.resume_position = max(0, int(data['position']))
 
-    @XBlock.json_handler
-    def saveTotalWatchTime(self, data, suffix=''): # pylint: disable=unused-argument
+        increments = timeline_encoding.range_increments(ranges)
+        duration = min(int(data.get('duration') or 0), timeline_encoding.MAX_SECONDS)
+        if duration > 0:
+            # Extend the total timeline to the whole video
+            increments.append((duration - 1, 0))
+        if not increments:
+            return
+        counters = self.get_counters()
+        if counters is not None:
+            counters.append(self.counters_scope, 'timeline', increments)
+            return
+
+        total_timeline = timeline_encoding.apply_increments(
+            timeline_encoding.decode(self.total_timeline), increments
+        )
+        heatmap = json.loads(self.timeline_heatmap) if self.timeline_heatmap else None
+        heatmap = timeline_encoding.update_heatmap(heatmap, total_timeline, increments)
+        self.total_timeline = timeline_encoding.encode(total_timeline)
+        self.timeline_heatmap = json.dumps(heatmap)
+
+    def get_resume_position(self):
         """
-        Return the watch data in timeline
+        Position from which playback should resume: the last reported
+        position, or the end of the watched range that starts the video.
         """
-        
-        self.total_views += 1
+        if self.resume_position:
+            return self.resume_position
+        watched = timeline_encoding.decode_ranges(self.user_watched)
+        if watched and watched[0][0] == 0:
+            return watched[0][1]
+        return 0
+
+    def update_watch_time(self, data):
+        self.incr_summary('total_views')
         self.user_views += 1
-        self.total_watch_time += data['watchTime']
+        self.incr_summary('total_watch_time', data['watchTime'])
+        self.record_rollup('views')
+        self.record_rollup('watch_time', data['watchTime'])
         self.user_watch_time = data['watchTime']
         self.last_watch_date = data['watchDate']
 
-    @XBlock.json_handler
-    def saveTranscriptDownloaded(self, data, suffix=''): # pylint: disable=unused-argument
-        """
-        Return the watch data in timeline
-        """
-        
-        self.transcript_downloads += 1
+    def update_transcript_downloads(self, data): # pylint: disable=unused-argument
+        self.incr_summary('transcript_downloads')
+        self.record_rollup('transcript_downloads')
 
-    @XBlock.json_handler
-    def saveVideoDownloaded(self, data, suffix=''): # pylint: disable=unused-argument
-        """
-        Return the watch data in timeline
-        """
-        
-        self.video_downloads += 1
+    def update_video_downloads(self, data): # pylint: disable=unused-argument
+        self.incr_summary('video_downloads')
+        self.record_rollup('video_downloads')
 
-    @XBlock.json_handler
-    def saveMostUsedControls(self, data, suffix=''): # pylint: disable=unused-argument
-        """
-        Return the watch data in timeline
-        """
-        
+    def update_most_used_controls(self, data):
         new_used_controls = data['controls'].split(",")
+        self.record_rollup('controls', sum(int(count) for count in new_used_controls))
+        counters = self.get_counters()
+        if counters is not None:
+            self._summary = None
+            for index, count in enumerate(new_used_controls[:self.controls_count]):
+                counters.incr(self.counters_scope, summary_fields.control_counter_name(index), int(count))
+            return
+
         most_used = self.most_used_controls.split(",")
         for i in range(len(most_used), len(new_used_controls)):
             most_used.append("0")
@@ -496,5 +1353,4 @@ class VideofrontXBlock(StudioEditableXBlockMixin, XBlock):
             most_used[i] = str(int(most_used[i]) + int(new_used_controls[i]))
 
         self.most_used_controls = ",".join(most_used)
-
-        return
+        self._summary = None